@@ -0,0 +1,292 @@
+"""event storm benchmark of SortingAgent, end to end and offline
+
+a synthetic tree is generated for every pipeline count, sorted once by the initial
+scan, then grown while the agent runs so watchdog events drive it. notifications go
+to a real Dove whose backend answers from an in-process stub, not the network.
+
+    python benchmarks/event_storm.py --files 10000 --pipelines 1 --pipelines 16 -o result.json
+"""
+import json
+import logging
+import os
+import pathlib
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from fnmatch import fnmatch
+import click
+import httpx
+import yaml
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+
+from dove import Dove  # noqa: E402
+from sorting_agent import SortingAgent  # noqa: E402
+
+BLACKLIST = "*.skip.*"
+
+
+class StubDove(Dove):
+    """Dove whose backends are answered in process"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.requests = 0
+
+    def _handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        return httpx.Response(200)
+
+    def _create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self._handle))
+
+
+class BenchAgent(SortingAgent):
+    """SortingAgent reporting every handled context"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.done = []
+        self._lock_ = threading.Lock()
+
+    async def _async_handle(self, context):
+        await super()._async_handle(context)
+        with self._lock_:
+            self.done.append((context["source"], context["timestamp"], time.time_ns()))
+
+
+def rss_bytes() -> int | None:
+    """resident set size of this process right now, None where /proc is missing"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def process_peak_rss_bytes() -> int:
+    # ru_maxrss is the peak of the whole process so far, in KiB on linux and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Sampler(threading.Thread):
+    """peaks of queue depth, in-flight tasks of an agent and resident memory"""
+
+    def __init__(self, agent: SortingAgent, interval: float = 0.01) -> None:
+        super().__init__(name="sampler", daemon=True)
+        self._agent_ = agent
+        self._interval_ = interval
+        self._stopped_ = threading.Event()
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.rss = None
+
+    def run(self):
+        while not self._stopped_.wait(self._interval_):
+            self.in_flight = max(self.in_flight, len(self._agent_._current_tasks_))
+            self.queue_depth = max(self.queue_depth, self._agent_._scheduler_.qsize())
+            rss = rss_bytes()
+            if rss is not None:
+                self.rss = max(self.rss or 0, rss)
+
+    def stop(self):
+        self._stopped_.set()
+        self.join()
+
+
+def tree(root: pathlib.Path, depth: int, width: int) -> list[pathlib.Path]:
+    """make directories of depth and width, return the leaves"""
+    leaves = [root]
+    for _ in range(depth):
+        leaves = [x / f"d{i}" for x in leaves for i in range(width)]
+    for item in leaves:
+        item.mkdir(parents=True, exist_ok=True)
+    return leaves
+
+
+def generate(leaves: list[pathlib.Path], files: int, size: tuple[int, int], pipelines: int,
+             blacklist: float, rng: random.Random) -> dict[pathlib.Path, int]:
+    """write files over leaves, return their creation time in ns"""
+    block = rng.randbytes(size[1])
+    ret = {}
+    for i in range(files):
+        name = f"f{i}.skip.e{i % pipelines}" if rng.random() < blacklist else f"f{i}.e{i % pipelines}"
+        path = leaves[i % len(leaves)] / name
+        path.write_bytes(block[:rng.randint(*size)])
+        ret[path] = time.time_ns()
+    return ret
+
+
+def build_config(path: pathlib.Path, input: pathlib.Path, output: pathlib.Path, pipelines: int,
+                 debounce: float, publish: bool):
+    steps = [
+        {"type": "skip_directory"},
+        {"type": "digest", "arg": ["md5"]},
+        {"type": "parse_filename"},
+        {"type": "move", "arg": "{output}/{name}/{md5}{suffix}"},
+    ]
+    if publish:
+        steps.append({"type": "publish", "arg": {"server": "bench-dove", "title": "{name}", "msg": "{filename}"}})
+    raw = {
+        "debounce": debounce,
+        "pipelines": [{
+            "name": f"e{i}",
+            "glob": f"*.e{i}",
+            "input": str(input),
+            "blacklist": [BLACKLIST],
+            "context": {"output": str(output)},
+            "process": steps,
+        } for i in range(pipelines)],
+    }
+    with open(path, "w") as f:
+        yaml.dump(raw, f)
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def wait(agent: BenchAgent, start: int, finished, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if finished(agent.done[start:]) and not agent._current_tasks_:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def summarize(agent: BenchAgent, start: int, elapsed: float, created: dict[pathlib.Path, int],
+              finished: bool, sampler: Sampler, dove: StubDove) -> dict:
+    done = agent.done[start:]
+    # from the file written, or from the push of the scanner, to the end of its pipelines
+    latency = [(end - created.get(source, pushed)) / 1e9 for source, pushed, end in done]
+    return {
+        "finished": finished,
+        "events": len(done),
+        "seconds": elapsed,
+        "events_per_second": len(done) / elapsed if elapsed else None,
+        "latency_p50": percentile(latency, 0.50),
+        "latency_p99": percentile(latency, 0.99),
+        "latency_max": max(latency, default=None),
+        "peak_in_flight": sampler.in_flight,
+        "peak_queue_depth": sampler.queue_depth,
+        "published": dove.requests,
+        # sampled during the phase, the process peak also covers the phases before
+        "peak_rss_bytes": sampler.rss,
+        "process_peak_rss_bytes": process_peak_rss_bytes(),
+    }
+
+
+def run(workdir: pathlib.Path, dove: StubDove, pipelines: int, files: int, live: int, size: tuple[int, int],
+        depth: int, width: int, blacklist: float, debounce: float, publish: bool, timeout: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    input, output = workdir / "input", workdir / "output"
+    initial = workdir / "input" / "initial"
+    generate(tree(initial, depth, width), files, size, pipelines, blacklist, rng)
+    # every file and directory of the tree is an event, along with input itself
+    expected = set(input.rglob("*")) | {input}
+    config = workdir / "sorting_config.yml"
+    build_config(config, input, output, pipelines, debounce, publish)
+
+    agent = BenchAgent(name=f"bench-{pipelines}")
+    agent.load_config(config)
+    sampler = Sampler(agent)
+    sampler.start()
+    requests = dove.requests
+    ts = time.monotonic()
+    agent.start()
+    finished = wait(agent, 0, lambda x: expected <= {y for y, _, _ in x}, timeout)
+    scan = summarize(agent, 0, time.monotonic() - ts, {}, finished, sampler, dove)
+    scan["expected"] = len(expected)
+    scan["published"] -= requests
+
+    sampler.in_flight = sampler.queue_depth = 0
+    sampler.rss = None
+    requests = dove.requests
+    start = len(agent.done)
+    ts = time.monotonic()
+    # files written before inotify watches their new directory come as created events
+    created = generate(tree(input / "live", depth, width), live, size, pipelines, blacklist, rng)
+    # blacklisted files are dropped by the observer, they never reach the agent
+    created = {x: y for x, y in created.items() if not fnmatch(x.name, BLACKLIST)}
+    finished = wait(agent, start, lambda x: created.keys() <= {y for y, _, _ in x}, timeout)
+    storm = summarize(agent, start, time.monotonic() - ts, created, finished, sampler, dove)
+    storm["expected"] = len(created)
+    storm["published"] -= requests
+
+    sampler.stop()
+    agent.require_quit()
+    agent.join()
+    return {"pipelines": pipelines, "scan": scan, "live": storm}
+
+
+@click.command(help="benchmark SortingAgent against a storm of events")
+@click.option("--files", default=5000, help="files of the initial tree")
+@click.option("--live", default=1000, help="files written while the agent runs")
+@click.option("--size", default=4096, help="size of files in bytes")
+@click.option("--size-max", default=None, type=int, help="sizes are uniform in [size, size-max] if given")
+@click.option("--depth", default=3, help="levels of directories")
+@click.option("--width", default=4, help="subdirectories of every directory")
+@click.option("--pipelines", default=[1, 16], multiple=True, help="pipeline counts to compare, repeatable")
+@click.option("--blacklist", default=0.1, help="ratio of files hit by the blacklist")
+@click.option("--debounce", default=0.1, help="debounce window in seconds")
+@click.option("--publish/--no-publish", default=True, help="publish every sorted file to the stub Dove")
+@click.option("--timeout", default=300.0, help="seconds to wait for a phase")
+@click.option("--seed", default=0)
+@click.option("--workdir", default=None, type=click.Path(file_okay=False), help="temporary directory by default")
+@click.option("-o", "--output", default=None, type=click.Path(dir_okay=False), help="write results as json")
+@click.option("-l", "--log-level", default="error",
+              type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False))
+def main(files, live, size, size_max, depth, width, pipelines, blacklist, debounce, publish, timeout, seed,
+         workdir, output, log_level):
+    logging.basicConfig(level=log_level.upper(), format="[%(threadName)s] %(message)s")
+    params = {"files": files, "live": live, "size": size, "size_max": size_max or size, "depth": depth,
+              "width": width, "blacklist": blacklist, "debounce": debounce, "publish": publish, "seed": seed}
+    base = pathlib.Path(tempfile.mkdtemp(prefix="event-storm-", dir=workdir))
+    dove_cfg = base / "dove.yml"
+    with open(dove_cfg, "w") as f:
+        yaml.dump({"doves": [{"name": "stub", "type": "bark", "arg": {"key": "bench"}}]}, f)
+    dove = StubDove(name="bench-dove", daemon=True)
+    dove.load_config(dove_cfg)
+    dove.start()
+
+    results = []
+    try:
+        for item in pipelines:
+            path = base / f"pipelines-{item}"
+            path.mkdir()
+            result = run(path, dove, item, files, live, (size, size_max or size), depth, width, blacklist,
+                         debounce, publish, timeout, seed)
+            logging.warning(f"{item} pipeline(s): {json.dumps(result)}")
+            results.append(result)
+    finally:
+        dove.require_quit()
+        dove.join()
+        shutil.rmtree(base, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        pathlib.Path(output).write_text(text)
+    click.echo(text)
+
+
+if __name__ == "__main__":
+    main()
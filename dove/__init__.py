@@ -1,4 +1,4 @@
 from .dove import Dove
-from .extern import publish
+from .extern import publish, close_publishers
 
-__all__ = ["Dove", "publish"]
+__all__ = ["Dove", "publish", "close_publishers"]
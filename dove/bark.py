@@ -19,9 +19,8 @@ class Bark(DoveBase):
             data["group"] = msg["group"]
         elif self._group:
             data["group"] = self._group
-        async with httpx.AsyncClient() as client:
-            ret = await client.post(self._url, data=data)
-            if ret.status_code != httpx.codes.OK:
-                logging.error(f"post to {self._url} with data={data} failed with status_code={ret.status_code}")
-                ret.raise_for_status()
+        ret = await self.client.post(self._url, data=data)
+        if ret.status_code != httpx.codes.OK:
+            logging.error(f"post to {self._url} with data={data} failed with status_code={ret.status_code}")
+            ret.raise_for_status()
 
@@ -1,11 +1,23 @@
 import logging
 from typing import Optional
+import httpx
 
 __all__ = ["DoveBase"]
 
 class DoveBase():
     def __init__(self, name: str) -> None:
         self._name_ = name
+        self._client_: Optional[httpx.AsyncClient] = None
+
+    def bind(self, client: httpx.AsyncClient) -> None:
+        """share the pooled client of Dove"""
+        self._client_ = client
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client_ is None:
+            raise RuntimeError(f"{self._name_} is not bound to a client")
+        return self._client_
 
     async def publish(self, msg: dict) -> None:
         logging.info(f"publish msg={msg}")
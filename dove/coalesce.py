@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Callable
+
+__all__ = ["Coalescer"]
+
+
+class Coalescer():
+    """merge messages of the same title and group into one summary
+
+    the first message of a group opens a window, the group is flushed when the window
+    expires or `count` messages are collected. a single message is forwarded untouched,
+    messages with a true `urgent` field are never held back.
+    `summary` is formatted with count, title, group, first and last.
+    outbox ids of merged messages travel with the summary
+    """
+
+    def __init__(self, forward: Callable[[dict, list[int]], object], window: float = 10.0, count: int = 100,
+                 summary: str = "{count} messages of {title}, the last: {last}") -> None:
+        self._forward_ = forward
+        self._window_ = window
+        self._count_ = count
+        self._summary_ = summary
+        self._groups_: dict[tuple, list[tuple[dict, list[int]]]] = {}
+        self._timers_: dict[tuple, asyncio.TimerHandle] = {}
+
+    def put(self, msg: dict, ids: list[int] = []) -> None:
+        if msg.get("urgent", False):
+            self._forward_(msg, ids)
+            return
+        key = (msg.get("title", None), msg.get("group", None))
+        group = self._groups_.setdefault(key, [])
+        group.append((msg, ids))
+        if len(group) >= self._count_:
+            self.flush(key)
+        elif len(group) == 1:
+            loop = asyncio.get_running_loop()
+            self._timers_[key] = loop.call_later(self._window_, self.flush, key)
+
+    def flush(self, key: tuple) -> None:
+        timer = self._timers_.pop(key, None)
+        if timer:
+            timer.cancel()
+        group = self._groups_.pop(key, [])
+        if len(group) == 1:
+            self._forward_(*group[0])
+        elif group:
+            logging.debug(f"coalesce {len(group)} messages of {key}")
+            first, last = group[0][0], group[-1][0]
+            msg = dict(last)
+            msg["msg"] = self._summary_.format(count=len(group), title=key[0], group=key[1],
+                                               first=first.get("msg", ""), last=last.get("msg", ""))
+            self._forward_(msg, [x for _, ids in group for x in ids])
+
+    def flush_all(self) -> None:
+        for key in list(self._groups_.keys()):
+            self.flush(key)
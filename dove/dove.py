@@ -1,14 +1,19 @@
-import traceback
 from .base import DoveBase
 from .serverchan import ServerChan
 from .bark import Bark
+from .sender import Sender
+from .coalesce import Coalescer
+from .outbox import Outbox
+from . import extern
 
 import asyncio
+import importlib.util
 from typing import Callable, Iterable, Mapping, Any, Optional
 import pathlib
 import threading
 import yaml
 import logging
+import httpx
 from aiozmq import rpc
 import shortuuid
 import time
@@ -25,6 +30,10 @@ class Handler(rpc.AttrHandler):
     def publish(self, msg, names):
         self._dove_.publish(msg, names)
 
+    @rpc.method
+    def hello(self, token):
+        extern.acknowledge(token)
+
 
 class Dove(threading.Thread):
     def __init__(self,
@@ -38,7 +47,14 @@ class Dove(threading.Thread):
         super().__init__(None, target, name, args, kwargs, daemon=daemon)
         self._loop_ = asyncio.new_event_loop()
         self._doves_: dict[str, DoveBase] = {}
+        self._senders_: dict[str, Sender] = {}
+        self._coalescers_: dict[str, Coalescer] = {}
+        self._outbox_: Optional[Outbox] = None
+        self._replay_: Optional[asyncio.Task] = None
+        self._stopping_ = False
         self._event_quit_ = asyncio.Event()
+        self._http_cfg_: dict = {}
+        self._client_: Optional[httpx.AsyncClient] = None
 
     def _factory(self, type: str, name: str, arg: Any) -> DoveBase:
         match type.lower():
@@ -52,9 +68,29 @@ class Dove(threading.Thread):
     def load_config(self, path: pathlib.Path | str):
         with open(path, "r") as f:
             cfg = yaml.load(f, Loader=yaml.SafeLoader)
+        self._http_cfg_ = cfg.get("http", {})
+        if cfg.get("outbox", None):
+            self._outbox_ = Outbox(cfg["outbox"])
+        settle = self._outbox_.settle if self._outbox_ else None
         for item in cfg["doves"]:
             name = item.get("name", shortuuid.random())
             self._doves_[name] = self._factory(item["type"], name, item["arg"])
+            self._senders_[name] = Sender(self._doves_[name], settle=settle, **item.get("sender", {}))
+            if "coalesce" in item.keys():
+                # a flushed summary waits for space rather than being dropped
+                self._coalescers_[name] = Coalescer(self._senders_[name].offer, **item["coalesce"])
+
+    def _create_client(self) -> httpx.AsyncClient:
+        cfg = self._http_cfg_
+        limits = httpx.Limits(max_connections=cfg.get("max_connections", 10),
+                              max_keepalive_connections=cfg.get("max_keepalive_connections", 5),
+                              keepalive_expiry=cfg.get("keepalive_expiry", 30.0))
+        timeout = httpx.Timeout(cfg.get("timeout", 10.0), connect=cfg.get("connect_timeout", 5.0))
+        http2 = cfg.get("http2", False)
+        if http2 and importlib.util.find_spec("h2") is None:
+            logging.warning("http2 requires the h2 package, fall back to http/1.1")
+            http2 = False
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
 
     async def _async_quit(self):
         self._event_quit_.set()
@@ -64,13 +100,54 @@ class Dove(threading.Thread):
 
     async def _async_publish(self, msg: dict, names: Optional[list[str]] = None):
         if not names:
-            names = self._doves_.keys()
+            names = self._senders_.keys()
         for name in names:
-            try:
-                await self._doves_[name].publish(msg)
-            except Exception as e:
-                logging.error(f"cannot publish to {name}: {e}")
-                logging.error(traceback.format_exc())
+            if name not in self._senders_.keys():
+                logging.error(f"cannot publish to {name}: not found")
+                continue
+            ids = [self._outbox_.append(name, msg)] if self._outbox_ else []
+            if self._stopping_:
+                # the senders are draining, the outbox still keeps it for the next start
+                logging.warning(f"{name} is stopping, {'keep' if ids else 'drop'} msg={msg}")
+                continue
+            if name in self._coalescers_.keys():
+                self._coalescers_[name].put(msg, ids)
+            else:
+                self._senders_[name].put(msg, ids)
+
+    async def _async_start(self):
+        for item in self._senders_.values():
+            item.start()
+        if self._outbox_:
+            self._replay_ = self._loop_.create_task(self._async_replay(self._outbox_.open()))
+
+    async def _async_replay(self, rows: list[tuple[int, str, dict]]):
+        # a backlog may outgrow the queues, so wait for space instead of dropping
+        for id, name, msg in rows:
+            if name not in self._senders_.keys():
+                logging.warning(f"drop message {id} of removed dove {name}")
+                self._outbox_.settle([id])
+                continue
+            if name in self._coalescers_.keys():
+                self._coalescers_[name].put(msg, [id])
+            else:
+                await self._senders_[name].put_wait(msg, [id])
+        logging.info(f"{len(rows)} message(s) of the outbox replayed")
+
+    async def _async_stop(self):
+        self._stopping_ = True
+        if self._replay_:
+            # rows not replayed yet stay in the outbox
+            self._replay_.cancel()
+            await asyncio.gather(self._replay_, return_exceptions=True)
+        for item in self._coalescers_.values():
+            item.flush_all()
+        # the summaries just flushed and every queued message are delivered while the senders drain,
+        # all of them at once, so shutdown takes at most the longest drain
+        await asyncio.gather(*[x.stop() for x in self._senders_.values()])
+        await self._client_.aclose()
+        if self._outbox_:
+            self._outbox_.close()
 
     def publish(self, msg: dict, names: Optional[list[str]] = None):
         asyncio.run_coroutine_threadsafe(self._async_publish(msg, names), self._loop_)
@@ -82,8 +159,13 @@ class Dove(threading.Thread):
         handler = Handler(self)
         server = self._loop_.run_until_complete(rpc.serve_pubsub(handler, subscribe="publish", bind=url))
         logging.info(f"server {url} created")
+        self._client_ = self._create_client()
+        for item in self._doves_.values():
+            item.bind(self._client_)
+        self._loop_.run_until_complete(self._async_start())
         logging.info("started")
         self._loop_.run_until_complete(self._event_quit_.wait())
         server.close()
         self._loop_.run_until_complete(server.wait_closed())
+        self._loop_.run_until_complete(self._async_stop())
         logging.info("stopped")
@@ -2,13 +2,92 @@ from typing import Optional
 from aiozmq import rpc
 import asyncio
 import logging
-import time
+import threading
+import shortuuid
 
-__all__ = ["rpc"]
+__all__ = ["rpc", "publish", "close_publishers"]
+
+# handshake tokens waiting for the acknowledgement of a Dove server, in the same process
+_handshakes_: dict[str, tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+_handshakes_mutex_ = threading.Lock()
+
+_publishers_: dict[tuple[asyncio.AbstractEventLoop, str], "Publisher"] = {}
+
+
+def acknowledge(token: str):
+    """called by the Dove server when it receives a handshake, from its own thread"""
+    with _handshakes_mutex_:
+        item = _handshakes_.pop(token, None)
+    if item:
+        loop, future = item
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+
+class Publisher():
+    """long-lived pub/sub client of a Dove server
+
+    a zmq subscriber drops everything published before its subscription arrives,
+    so the publisher repeats a handshake until the server acknowledges it
+    """
+
+    def __init__(self, server: str, timeout: float = 5.0) -> None:
+        self._server_ = server
+        self._timeout_ = timeout
+        self._client_: Optional[rpc.pubsub.PubSubClient] = None
+        self._ready_: Optional[asyncio.Task] = None
+
+    async def _connect(self):
+        url = f"inproc://{self._server_}"
+        self._client_ = await rpc.connect_pubsub(connect=url)
+        loop = asyncio.get_running_loop()
+        token = shortuuid.uuid()
+        future = loop.create_future()
+        with _handshakes_mutex_:
+            _handshakes_[token] = (loop, future)
+
+        async def handshake():
+            interval = 0.001
+            while not future.done():
+                await self._client_.publish('publish').hello(token)
+                await asyncio.wait([future], timeout=interval)
+                interval = min(interval * 2, 0.1)
+
+        try:
+            await asyncio.wait_for(handshake(), self._timeout_)
+        except asyncio.TimeoutError:
+            self._client_.close()
+            self._client_ = None
+            raise ConnectionError(f"no acknowledgement from {url} in {self._timeout_}s")
+        finally:
+            with _handshakes_mutex_:
+                _handshakes_.pop(token, None)
+        logging.info(f"publisher of {url} is ready")
+
+    async def publish(self, msg: dict, names: Optional[list[str]] = None):
+        ready = self._ready_
+        if ready is None or (ready.done() and (ready.cancelled() or ready.exception())):
+            self._ready_ = asyncio.ensure_future(self._connect())
+        await asyncio.shield(self._ready_)
+        await self._client_.publish('publish').publish(msg, names)
+
+    async def close(self):
+        if self._ready_ and not self._ready_.done():
+            self._ready_.cancel()
+        if self._client_:
+            self._client_.close()
+            await self._client_.wait_closed()
+            self._client_ = None
 
 
 async def publish(server: str, msg: dict, names: Optional[list[str]] = None):
-    url = f"inproc://{server}"
-    client: rpc.pubsub.PubSubClient = await rpc.connect_pubsub(connect=url)
-    await asyncio.sleep(0.1)
-    await client.publish('publish').publish(msg, names)
+    key = (asyncio.get_running_loop(), server)
+    if key not in _publishers_.keys():
+        _publishers_[key] = Publisher(server)
+    await _publishers_[key].publish(msg, names)
+
+
+async def close_publishers():
+    """close the publishers of the running loop"""
+    loop = asyncio.get_running_loop()
+    for key in [x for x in _publishers_.keys() if x[0] is loop]:
+        await _publishers_.pop(key).close()
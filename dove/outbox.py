@@ -0,0 +1,117 @@
+import itertools
+import json
+import logging
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+__all__ = ["Outbox"]
+
+_SCHEMA_ = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    backend TEXT NOT NULL,
+    msg TEXT NOT NULL,
+    created INTEGER NOT NULL
+)
+"""
+
+
+class Outbox():
+    """disk-backed outbox of Dove messages
+
+    messages are appended with an id and removed once a backend settled them.
+    both are queued and committed in groups by a background thread, so callers
+    never wait for the disk. unsettled messages are replayed by `open`
+    """
+
+    def __init__(self, path: str | pathlib.Path, batch_size: int = 256, interval: float = 0.5,
+                 vacuum_every: int = 4096) -> None:
+        self._path_ = pathlib.Path(path)
+        self._batch_size_ = batch_size
+        self._interval_ = interval
+        self._vacuum_every_ = vacuum_every
+        self._queue_: queue.Queue = queue.Queue()
+        self._writer_: Optional[threading.Thread] = None
+        # messages may be appended before open, their ids must not collide with unsettled rows
+        self._ids_ = itertools.count(self._last_id() + 1)
+
+    def _last_id(self) -> int:
+        if not self._path_.exists():
+            return 0
+        conn = sqlite3.connect(self._path_)
+        try:
+            with conn:
+                conn.execute(_SCHEMA_)
+            return conn.execute("SELECT max(id) FROM outbox").fetchone()[0] or 0
+        finally:
+            conn.close()
+
+    def open(self) -> list[tuple[int, str, dict]]:
+        """open the outbox, return unsettled (id, backend, msg) in order"""
+        self._path_.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self._path_)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(_SCHEMA_)
+        rows = conn.execute("SELECT id, backend, msg FROM outbox ORDER BY id").fetchall()
+        conn.close()
+        self._writer_ = threading.Thread(target=self._write_loop, name="dove-outbox", daemon=True)
+        self._writer_.start()
+        logging.info(f"outbox {self._path_} opened, {len(rows)} message(s) to replay")
+        return [(x, y, json.loads(z)) for x, y, z in rows]
+
+    def close(self) -> None:
+        if self._writer_ is None:
+            return
+        self._queue_.put(None)
+        self._writer_.join()
+        self._writer_ = None
+
+    def append(self, backend: str, msg: dict) -> int:
+        id = next(self._ids_)
+        self._queue_.put(("append", id, backend, json.dumps(msg, default=str)))
+        return id
+
+    def settle(self, ids: list[int]) -> None:
+        for id in ids:
+            self._queue_.put(("settle", id))
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self._path_)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        quit = False
+        settled = 0
+        while not quit:
+            batch = []
+            deadline = time.monotonic() + self._interval_
+            while len(batch) < self._batch_size_:
+                try:
+                    item = self._queue_.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    quit = True
+                    break
+                batch.append(item)
+            if not batch:
+                continue
+            now = time.time_ns()
+            try:
+                with conn:
+                    for item in batch:
+                        if item[0] == "append":
+                            conn.execute("INSERT OR REPLACE INTO outbox VALUES (?, ?, ?, ?)", (*item[1:], now))
+                        else:
+                            conn.execute("DELETE FROM outbox WHERE id=?", (item[1],))
+                            settled += 1
+                if settled >= self._vacuum_every_:
+                    conn.execute("PRAGMA incremental_vacuum")
+                    settled = 0
+            except sqlite3.Error as e:
+                logging.error(f"outbox failed to commit {len(batch)} operations: {e}")
+        conn.close()
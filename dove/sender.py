@@ -0,0 +1,175 @@
+import asyncio
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import logging
+import random
+import time
+import traceback
+from typing import Callable, Optional
+import httpx
+from metrics import registry
+from .base import DoveBase
+
+__all__ = ["Sender"]
+
+_send_seconds_ = registry.histogram("dove_send_seconds", "time of a request to a backend", ["backend"])
+_sent_ = registry.counter("dove_sent_total", "messages delivered, by backend", ["backend"])
+_errors_ = registry.counter("dove_errors_total", "failed requests, by backend and kind", ["backend", "kind"])
+_queue_depth_ = registry.gauge("dove_queue_depth", "messages waiting to be sent", ["backend"])
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After", None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class Sender():
+    """bounded outbound queue of one dove
+
+    `concurrency` workers publish messages, failures are retried with exponential
+    backoff and full jitter. a 429 pauses the whole backend until Retry-After.
+    `settle(ids)` is called once a message was delivered or rejected for good,
+    but not when retries ran out, so the outbox replays it later.
+    `stop` keeps delivering queued messages for at most `drain` seconds
+    """
+
+    def __init__(self, dove: DoveBase, queue_size: int = 1024, concurrency: int = 2,
+                 retries: int = 5, backoff: float = 1.0, max_backoff: float = 300.0,
+                 drain: float = 10.0, settle: Optional[Callable[[list[int]], None]] = None) -> None:
+        self._dove_ = dove
+        self._drain_ = drain
+        self._settle_ = settle
+        self._concurrency_ = concurrency
+        self._retries_ = retries
+        self._backoff_ = backoff
+        self._max_backoff_ = max_backoff
+        self._queue_: asyncio.Queue = asyncio.Queue(queue_size)
+        self._workers_: list[asyncio.Task] = []
+        self._waiting_: set[asyncio.Task] = set()
+        self._sending_ = 0
+        self._resume_at_ = 0.0
+        self._latency_ = _send_seconds_.labels(self.name)
+        self._sent_ = _sent_.labels(self.name)
+        self._errors_ = {x: _errors_.labels(self.name, x)
+                         for x in ("rate_limited", "rejected", "server", "transport", "unexpected", "exhausted")}
+        _queue_depth_.labels(self.name).set_function(self.qsize)
+
+    @property
+    def name(self) -> str:
+        return self._dove_._name_
+
+    def put(self, msg: dict, ids: list[int] = []) -> bool:
+        try:
+            self._queue_.put_nowait((msg, ids))
+        except asyncio.QueueFull:
+            logging.error(f"queue of {self.name} is full, drop msg={msg}")
+            return False
+        return True
+
+    async def put_wait(self, msg: dict, ids: list[int] = []) -> None:
+        """queue a message, waiting for space"""
+        await self._queue_.put((msg, ids))
+
+    def offer(self, msg: dict, ids: list[int] = []) -> None:
+        """queue a message, and wait for space in a task if the queue is full"""
+        try:
+            self._queue_.put_nowait((msg, ids))
+        except asyncio.QueueFull:
+            task = asyncio.get_running_loop().create_task(self.put_wait(msg, ids))
+            self._waiting_.add(task)
+            task.add_done_callback(self._waiting_.discard)
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self._max_backoff_, self._backoff_ * 2 ** attempt))
+
+    async def _send(self, msg: dict) -> bool:
+        """return True if the message is settled"""
+        loop = asyncio.get_running_loop()
+        for attempt in range(self._retries_ + 1):
+            wait = self._resume_at_ - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            ts = time.perf_counter()
+            try:
+                await self._dove_.publish(msg)
+                self._latency_.observe(time.perf_counter() - ts)
+                self._sent_.inc()
+                return True
+            except httpx.HTTPStatusError as e:
+                self._latency_.observe(time.perf_counter() - ts)
+                status = e.response.status_code
+                if status == httpx.codes.TOO_MANY_REQUESTS:
+                    self._errors_["rate_limited"].inc()
+                    delay = _retry_after(e.response)
+                    if delay is None:
+                        delay = self._delay(attempt)
+                    logging.warning(f"{self.name} is rate limited, pause {delay:.1f}s")
+                    self._resume_at_ = max(self._resume_at_, loop.time() + delay)
+                    continue
+                if 400 <= status < 500:
+                    self._errors_["rejected"].inc()
+                    logging.error(f"cannot publish to {self.name}: {e}, dropped")
+                    return True
+                self._errors_["server"].inc()
+                logging.warning(f"cannot publish to {self.name}: {e}, attempt {attempt + 1}")
+            except (httpx.TransportError, OSError) as e:
+                self._errors_["transport"].inc()
+                logging.warning(f"cannot publish to {self.name}: {e!r}, attempt {attempt + 1}")
+            except Exception as e:
+                self._errors_["unexpected"].inc()
+                logging.error(f"cannot publish to {self.name}: {e}, dropped")
+                logging.error(traceback.format_exc())
+                return True
+            if attempt < self._retries_:
+                await asyncio.sleep(self._delay(attempt))
+        self._errors_["exhausted"].inc()
+        logging.error(f"give up publishing to {self.name} after {self._retries_ + 1} attempts")
+        return False
+
+    async def _worker(self):
+        while True:
+            msg, ids = await self._queue_.get()
+            self._sending_ += 1
+            try:
+                if await self._send(msg) and ids and self._settle_:
+                    self._settle_(ids)
+            finally:
+                self._sending_ -= 1
+                self._queue_.task_done()
+
+    def start(self) -> None:
+        """start workers, must be called in the loop thread"""
+        loop = asyncio.get_running_loop()
+        self._workers_ = [loop.create_task(self._worker()) for _ in range(self._concurrency_)]
+
+    async def _drain(self):
+        # asyncio.wait leaves the waiting puts alone when the drain times out
+        while self._waiting_:
+            await asyncio.wait(set(self._waiting_))
+        await self._queue_.join()
+
+    async def stop(self) -> None:
+        if self._workers_:
+            try:
+                await asyncio.wait_for(self._drain(), self._drain_)
+            except asyncio.TimeoutError:
+                pass
+        dropped = self.qsize() + len(self._waiting_) + self._sending_
+        if dropped:
+            logging.warning(f"{self.name} stopped after {self._drain_}s, {dropped} message(s) not delivered")
+        for item in self._workers_ + list(self._waiting_):
+            item.cancel()
+        await asyncio.gather(*self._workers_, *self._waiting_, return_exceptions=True)
+        self._workers_ = []
+
+    def qsize(self) -> int:
+        return self._queue_.qsize()
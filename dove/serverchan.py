@@ -15,9 +15,8 @@ class ServerChan(DoveBase):
         data["short"] = msg.get("short", None)
         if self._channel:
             data["channel"] = self._channel
-        async with httpx.AsyncClient() as client:
-            ret = await client.post(self._url, data=data)
-            if ret.status_code != httpx.codes.OK:
-                logging.error(f"post to {self._url} with data={data} failed with status_code={ret.status_code}")
-                ret.raise_for_status()
+        ret = await self.client.post(self._url, data=data)
+        if ret.status_code != httpx.codes.OK:
+            logging.error(f"post to {self._url} with data={data} failed with status_code={ret.status_code}")
+            ret.raise_for_status()
 
@@ -8,27 +8,120 @@ def main():
     pass
 
 
-@main.command(help="takeoff and start")
-@click.argument("config", default="./launch.yml", type=click.Path(exists=True))
-@click.option("-l", "--log-level", default="info",
-              type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False))
-def takeoff(config, log_level):
+def setup_logging(log_level):
     MAP_LOG_LEVEL = {
         "DEBUG": logging.DEBUG,
         "INFO": logging.INFO,
         "WARNING": logging.WARNING,
         "ERROR": logging.ERROR,
     }
+    log_level = log_level.upper()
     logging.basicConfig(level=MAP_LOG_LEVEL[log_level],
                         format="[%(threadName)s] %(message)s",
                         datefmt="[%m-%d %H:%M:%S]",
                         handlers=[RichHandler(rich_tracebacks=True)])
     logging.log(MAP_LOG_LEVEL[log_level], f"set log level to {log_level}")
 
+
+@main.command(help="takeoff and start")
+@click.argument("config", default="./launch.yml", type=click.Path(exists=True))
+@click.option("-l", "--log-level", default="info",
+              type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False))
+def takeoff(config, log_level):
+    setup_logging(log_level)
+
     from headquarter import entry
     entry(config)
 
 
+@main.command(help="sort the inputs of a sorting config once, without watching them")
+@click.argument("config", type=click.Path(exists=True))
+@click.option("-p", "--pipeline", multiple=True, help="run only this pipeline, repeatable")
+@click.option("-j", "--jobs", default=None, type=int, help="files handled at once, scheduler.concurrency by default")
+@click.option("-n", "--dry-run", is_flag=True, help="match files and render steps, without touching any file")
+@click.option("--dove", default=None, type=click.Path(exists=True),
+              help="dove config to deliver publish steps, they are skipped without it")
+@click.option("--dove-name", default="dove", help="name of the dove, the server of publish steps")
+@click.option("-l", "--log-level", default="warning",
+              type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False))
+def sort(config, pipeline, jobs, dry_run, dove, dove_name, log_level):
+    setup_logging(log_level)
+
+    from sorting_agent import SortingAgent
+    messenger = None
+    if dove and not dry_run:
+        from dove import Dove
+        messenger = Dove(name=dove_name, daemon=True)
+        messenger.load_config(dove)
+        messenger.start()
+    agent = SortingAgent(name="sort")
+    try:
+        agent.load_config(config)
+        summary = agent.sort(list(pipeline), jobs, dry_run, publish=messenger is not None, report=click.echo)
+    except (KeyError, ValueError) as e:
+        raise click.UsageError(str(e))
+    finally:
+        if messenger:
+            messenger.require_quit()
+            messenger.join()
+    for item in summary.lines():
+        click.echo(item)
+    if summary.failed:
+        raise SystemExit(1)
+
+
+@main.command(help="replay a recording of events into a sorting agent, without watching its inputs")
+@click.argument("config", type=click.Path(exists=True))
+@click.argument("recording", type=click.Path())
+@click.option("-s", "--speed", default=1.0, help="1 replays in real time, 0 as fast as possible")
+@click.option("-m", "--map", "mapping", multiple=True, required=True,
+              help="FROM=TO, replay paths under FROM at TO, repeatable, events elsewhere are skipped")
+@click.option("--materialize", is_flag=True, help="apply events to the mapped tree before handling them")
+@click.option("--dove", default=None, type=click.Path(exists=True),
+              help="dove config to deliver publish steps, they are skipped without it")
+@click.option("--dove-name", default="dove", help="name of the dove, the server of publish steps")
+@click.option("-l", "--log-level", default="warning",
+              type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False))
+def replay(config, recording, speed, mapping, materialize, dove, dove_name, log_level):
+    setup_logging(log_level)
+
+    from sorting_agent import SortingAgent
+    from sorting_agent.recorder import Replayer, read
+    try:
+        mapping = dict(x.split("=", 1) for x in mapping)
+    except ValueError:
+        raise click.BadParameter("expects FROM=TO", param_hint="--map")
+    messenger = None
+    if dove:
+        from dove import Dove
+        messenger = Dove(name=dove_name, daemon=True)
+        messenger.load_config(dove)
+        messenger.start()
+    agent = SortingAgent(name="replay")
+    agent.load_config(config)
+    handler = agent.detach()
+    if messenger is None:
+        agent.without("publish")
+    summary = agent.collect()
+    agent.start()
+    replayer = Replayer(handler, speed, mapping, materialize)
+    try:
+        replayer.replay(read(recording))
+        # pending events settle after their debounce window
+        agent.wait_idle()
+    finally:
+        agent.require_quit()
+        agent.join()
+        if messenger:
+            messenger.require_quit()
+            messenger.join()
+    summary.finish()
+    click.echo(f"replayed {replayer.events} events, skipped {replayer.skipped}, "
+               f"lagged {replayer.lag:.3f}s behind at most")
+    for item in summary.lines():
+        click.echo(item)
+
+
 @main.command(help="list all available processors of sorting agent")
 def list_processors():
     from sorting_agent import processes
@@ -2,6 +2,7 @@ import yaml
 import signal
 from sorting_agent import SortingAgent
 from dove import Dove
+from metrics import MetricsAgent
 import logging
 
 
@@ -19,6 +20,7 @@ def factory(object: dict):
     _MAP_ = {
         "sorting_agent": SortingAgent,
         "dove": Dove,
+        "metrics": MetricsAgent,
     }
     logging.debug(object)
 
@@ -0,0 +1,4 @@
+from .registry import Counter, Gauge, Histogram, Registry, registry
+from .exporter import MetricsAgent
+
+__all__ = ["Counter", "Gauge", "Histogram", "Registry", "registry", "MetricsAgent"]
@@ -0,0 +1,86 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import pathlib
+import socketserver
+import threading
+from typing import Optional
+import yaml
+from .registry import registry
+
+__all__ = ["MetricsAgent"]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # peers of a unix socket have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logging.debug(f"metrics {self.address_string()} {format % args}")
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsAgent(threading.Thread):
+    """serve the metrics registry in prometheus text format
+
+    config:
+        host, port --- tcp address, 127.0.0.1:9464 by default
+        unix --- path of a unix socket, instead of tcp
+    """
+
+    def __init__(self, group=None, name="metrics", args=(), kwargs={}, daemon=None):
+        super().__init__(group=group, name=name, args=args, kwargs=kwargs, daemon=daemon)
+        self._host_ = "127.0.0.1"
+        self._port_ = 9464
+        self._unix_: Optional[pathlib.Path] = None
+        self._server_: Optional[socketserver.BaseServer] = None
+
+    def load_config(self, path):
+        with open(path, "r") as f:
+            raw = yaml.load(f, Loader=yaml.SafeLoader) or {}
+        self._host_ = raw.get("host", self._host_)
+        self._port_ = int(raw.get("port", self._port_))
+        if raw.get("unix", None):
+            self._unix_ = pathlib.Path(raw["unix"])
+
+    def run(self):
+        if self._unix_:
+            if self._unix_.is_socket():
+                self._unix_.unlink()
+            self._server_ = _UnixHTTPServer(str(self._unix_), _Handler)
+            logging.info(f"serve metrics at {self._unix_}")
+        else:
+            self._server_ = ThreadingHTTPServer((self._host_, self._port_), _Handler)
+            self._server_.daemon_threads = True
+            logging.info(f"serve metrics at http://{self._host_}:{self._server_.server_address[1]}/metrics")
+        try:
+            self._server_.serve_forever()
+        finally:
+            self._server_.server_close()
+            if self._unix_:
+                try:
+                    os.unlink(self._unix_)
+                except FileNotFoundError:
+                    pass
+        logging.info(f"{self.name} quit")
+
+    def require_quit(self):
+        if self._server_:
+            threading.Thread(target=self._server_.shutdown, daemon=True).start()
@@ -0,0 +1,209 @@
+from bisect import bisect_left
+import math
+import threading
+from typing import Callable, Iterable, Optional
+
+__all__ = ["Counter", "Gauge", "Histogram", "Registry", "registry", "DEFAULT_BUCKETS"]
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    items = [f"{x}=\"{_escape(str(y))}\"" for x, y in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric():
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock_ = threading.Lock()
+        self._children_: dict[tuple[str, ...], object] = {}
+
+    def _child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        """child of label values, callers on a hot path should keep it"""
+        values = tuple(str(x) for x in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children_.get(values, None)
+        if child is None:
+            with self._lock_:
+                child = self._children_.setdefault(values, self._child())
+        return child
+
+    def _samples(self, values: tuple[str, ...], child) -> list[str]:
+        raise NotImplementedError
+
+    def collect(self) -> list[str]:
+        ret = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock_:
+            children = list(self._children_.items())
+        for values, child in children:
+            ret += self._samples(values, child)
+        return ret
+
+
+class _Value():
+    __slots__ = ("_lock_", "value", "function")
+
+    def __init__(self) -> None:
+        self._lock_ = threading.Lock()
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock_:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock_:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """evaluate function at every scrape instead of tracking a value"""
+        self.function = function
+
+    def get(self) -> float:
+        return float(self.function()) if self.function else self.value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self, values, child) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, values)} {_number(child.get())}"]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+    def remove(self, *values) -> None:
+        with self._lock_:
+            self._children_.pop(tuple(str(x) for x in values), None)
+
+    def _samples(self, values, child) -> list[str]:
+        try:
+            value = child.get()
+        except Exception:
+            return []
+        return [f"{self.name}{_labels(self.labelnames, values)} {_number(value)}"]
+
+
+class _Buckets():
+    __slots__ = ("_lock_", "bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self._lock_ = threading.Lock()
+        self.bounds = bounds
+        # the last one counts observations above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.bounds, value)
+        with self._lock_:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple[list[int], float]:
+        with self._lock_:
+            return list(self.counts), self.sum
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self, values, child) -> list[str]:
+        counts, total = child.snapshot()
+        ret = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = "le=\"" + _number(bound) + "\""
+            ret.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+        ret.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}")
+        ret.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return ret
+
+
+class Registry():
+    """metrics by name, registering a name twice returns the first metric"""
+
+    def __init__(self) -> None:
+        self._lock_ = threading.Lock()
+        self._metrics_: dict[str, _Metric] = {}
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock_:
+            if name not in self._metrics_.keys():
+                self._metrics_[name] = cls(name, *args, **kwargs)
+            metric = self._metrics_[name]
+        if type(metric) is not cls:
+            raise ValueError(f"metric {name} is a {metric.type}")
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labels, buckets)
+
+    def render(self) -> str:
+        """prometheus text exposition format"""
+        with self._lock_:
+            metrics = list(self._metrics_.values())
+        ret = []
+        for item in metrics:
+            ret += item.collect()
+        return "\n".join(ret) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,102 @@
+from collections import Counter
+from collections.abc import Mapping
+import threading
+import time
+from typing import Any, Optional
+from .processes import TemplatedProcesses
+from .template import render
+
+__all__ = ["Summary", "plan", "OUTCOME_PLANNED"]
+
+# matched by a dry run, none of its steps ran
+OUTCOME_PLANNED = "planned"
+
+
+class _Placeholders(Mapping):
+    """a context whose missing fields, which earlier steps would produce, render as <field>"""
+
+    def __init__(self, context: Mapping) -> None:
+        self._context_ = context
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self._context_[key]
+        except KeyError:
+            return f"<{key}>"
+
+    def __iter__(self):
+        return iter(self._context_)
+
+    def __len__(self) -> int:
+        return len(self._context_)
+
+
+def plan(pipeline: dict, context: Mapping) -> list[str]:
+    """steps of a pipeline with their templates rendered, without running any of them"""
+    ret = []
+    view = _Placeholders(context)
+    for step in pipeline["process"]:
+        arg = step.get("arg", None)
+        if step["type"] in TemplatedProcesses.keys() and arg is not None:
+            try:
+                arg = render(arg, view)
+            except Exception as e:
+                arg = f"<{e!r}>"
+        ret.append(step["type"] if arg is None else f"{step['type']}({arg})")
+    return ret
+
+
+class Summary():
+    """throughput and outcomes of a batch run, safe to update from the loop and read from others"""
+
+    def __init__(self, failures: int = 20) -> None:
+        self._lock_ = threading.Lock()
+        self._start_ = time.monotonic()
+        self._end_: Optional[float] = None
+        self._max_failures_ = failures
+        self.directories = 0
+        self.outcomes: Counter[str] = Counter()
+        self.pipelines: Counter[tuple[str, str]] = Counter()
+        self.bytes: Counter[str] = Counter()
+        self.failures: list[str] = []
+
+    def add(self, source, pipeline: Optional[str], outcome: str, size: int, is_dir: bool = False) -> None:
+        with self._lock_:
+            # directories mostly fail skip_directory, they are no failures of a backfill
+            if is_dir:
+                self.directories += 1
+                return
+            self.outcomes[outcome] += 1
+            if pipeline:
+                self.pipelines[(pipeline, outcome)] += 1
+                self.bytes[pipeline] += size
+                if outcome == "failure" and len(self.failures) < self._max_failures_:
+                    self.failures.append(str(source))
+
+    def finish(self) -> None:
+        self._end_ = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return (self._end_ or time.monotonic()) - self._start_
+
+    @property
+    def failed(self) -> int:
+        return self.outcomes["failure"]
+
+    def lines(self) -> list[str]:
+        elapsed = max(self.elapsed, 1e-9)
+        files = sum(self.outcomes.values())
+        total = sum(self.bytes.values())
+        ret = [f"{files} files and {self.directories} directories in {elapsed:.2f}s, {files / elapsed:.1f} files/s, "
+               f"{total / elapsed / 2 ** 20:.2f} MiB/s of matched files",
+               ", ".join(f"{x}: {y}" for x, y in sorted(self.outcomes.items()))]
+        for name in sorted({x for x, _ in self.pipelines.keys()}):
+            counts = ", ".join(f"{y}: {c}" for (x, y), c in sorted(self.pipelines.items()) if x == name)
+            ret.append(f"  {name}: {counts}, {self.bytes[name] / 2 ** 20:.2f} MiB")
+        if self.failures:
+            ret.append("failed:")
+            ret += [f"  {x}" for x in self.failures]
+            if self.failed > len(self.failures):
+                ret.append(f"  and {self.failed - len(self.failures)} more")
+        return ret
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from fnmatch import translate
+import logging
+import pathlib
+import re
+import threading
+
+__all__ = ["Blacklist"]
+
+
+class Blacklist():
+    """compiled blacklist of fnmatch patterns
+
+    all patterns are merged into one regex, matched against every part of a relative path.
+    verdicts of directories are kept in a bounded LRU, so files under a known directory
+    only need their own name to be matched. it is safe to share between threads
+    """
+
+    def __init__(self, patterns: list[str], cache_size: int = 4096) -> None:
+        self.patterns = list(patterns)
+        if self.patterns:
+            self._regex_ = re.compile("|".join(f"(?:{translate(x)})" for x in self.patterns))
+        else:
+            self._regex_ = None
+        self._cache_size_ = cache_size
+        self._cache_: OrderedDict[tuple[str, ...], bool] = OrderedDict()
+        self._lock_ = threading.Lock()
+
+    def _match_part(self, part: str) -> bool:
+        return self._regex_.match(part) is not None
+
+    def _directory(self, parts: tuple[str, ...]) -> bool:
+        if not parts:
+            return False
+        with self._lock_:
+            verdict = self._cache_.get(parts)
+            if verdict is not None:
+                self._cache_.move_to_end(parts)
+                return verdict
+        verdict = self._directory(parts[:-1]) or self._match_part(parts[-1])
+        with self._lock_:
+            self._cache_[parts] = verdict
+            if len(self._cache_) > self._cache_size_:
+                self._cache_.popitem(last=False)
+        return verdict
+
+    def directory(self, relative_path: pathlib.PurePath) -> bool:
+        """whether a directory, and so everything under it, is blacklisted"""
+        if self._regex_ is None:
+            return False
+        return self._directory(relative_path.parts)
+
+    def match(self, relative_path: pathlib.PurePath) -> bool:
+        if self._regex_ is None:
+            return False
+        parts = relative_path.parts
+        if not parts:
+            return False
+        if self._directory(parts[:-1]) or self._match_part(parts[-1]):
+            logging.debug(f"\'{relative_path}\' is blacklisted")
+            return True
+        return False
+
+    def clear(self) -> None:
+        with self._lock_:
+            self._cache_.clear()
@@ -0,0 +1,206 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from typing import Optional
+from .locks import LockManager
+from .shared import SharedEngine
+
+__all__ = ["CommandEngine", "CommandResult", "engine"]
+
+
+class _Capture():
+    """keep the last `limit` bytes of a stream, line by line, and match lines against patterns"""
+
+    def __init__(self, stream, limit: int, patterns: dict[str, re.Pattern]) -> None:
+        self._stream_ = stream
+        self._limit_ = limit
+        self._patterns_ = patterns
+        self._lines_: deque[bytes] = deque()
+        self._size_ = 0
+        self.fields: dict[str, str] = {}
+        self._thread_ = threading.Thread(target=self._read, daemon=True)
+        self._thread_.start()
+
+    def _read(self):
+        # lines longer than limit are split rather than buffered whole
+        for line in iter(lambda: self._stream_.readline(self._limit_), b""):
+            self._lines_.append(line)
+            self._size_ += len(line)
+            while self._size_ > self._limit_ and len(self._lines_) > 1:
+                self._size_ -= len(self._lines_.popleft())
+            if self._patterns_:
+                text = line.decode(errors="replace")
+                for name, pattern in self._patterns_.items():
+                    m = pattern.search(text)
+                    if m:
+                        self.fields[name] = m.group(1) if pattern.groups else m.group(0)
+        self._stream_.close()
+
+    def text(self, timeout: float) -> str:
+        self._thread_.join(timeout)
+        return b"".join(self._lines_)[-self._limit_:].decode(errors="replace")
+
+
+class CommandResult():
+    __slots__ = ("returncode", "stdout", "stderr", "fields", "wall_time", "cpu_time", "timeout")
+
+    def __init__(self, returncode, stdout, stderr, fields, wall_time, cpu_time, timeout) -> None:
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.fields = fields
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.timeout = timeout
+
+
+class CommandEngine(SharedEngine):
+    """run extern commands in their own process group, from a thread pool
+
+    stdout and stderr are drained while the command runs, so it never blocks on a
+    full pipe. at most `concurrency` commands run at once, and at most
+    `per_command[name]` of one command. cpu time comes from wait4 of the command.
+    groups outside the terminal session miss ctrl-c, so a cancelled step and shutdown
+    send SIGTERM to them, and SIGKILL after `grace` seconds
+    """
+
+    def __init__(self, concurrency: int = 4, per_command: Optional[dict[str, int]] = None,
+                 capture: int = 64 * 1024, grace: float = 5.0) -> None:
+        super().__init__()
+        self._concurrency_ = concurrency
+        self._per_command_ = per_command or {}
+        self._capture_ = capture
+        self._grace_ = grace
+        self._pool_: Optional[ThreadPoolExecutor] = None
+        # process groups whose leader is not reaped yet
+        self._groups_: set[int] = set()
+        self._reaped_ = threading.Condition()
+        # shared by the loops of every agent, "*" counts every command
+        self._limits_ = LockManager({"*": concurrency, **self._per_command_})
+
+    def configure(self, concurrency: Optional[int] = None, per_command: Optional[dict[str, int]] = None,
+                  capture: Optional[int] = None, grace: Optional[float] = None) -> None:
+        super().configure(concurrency=concurrency, per_command=per_command, capture=capture, grace=grace)
+
+    def _configure(self, concurrency=None, per_command=None, capture=None, grace=None):
+        if concurrency:
+            self._concurrency_ = concurrency
+        if per_command:
+            self._per_command_ = dict(per_command)
+        self._limits_.configure({"*": self._concurrency_, **self._per_command_})
+        if capture:
+            self._capture_ = capture
+        if grace:
+            self._grace_ = grace
+
+    def _kill(self, pid: int, sig: int):
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _kill_alive(self, pid: int):
+        with self._reaped_:
+            if pid not in self._groups_:
+                return
+        logging.warning(f"process group {pid} outlived SIGTERM, kill it")
+        self._kill(pid, signal.SIGKILL)
+
+    def _terminate(self, pid: int):
+        self._kill(pid, signal.SIGTERM)
+        timer = threading.Timer(self._grace_, self._kill_alive, (pid,))
+        timer.daemon = True
+        timer.start()
+
+    def _run(self, args: list[str], timeout: Optional[float], patterns: dict[str, re.Pattern],
+             job: dict) -> CommandResult:
+        ts = time.monotonic()
+        p = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             start_new_session=True)
+        with self._reaped_:
+            self._groups_.add(p.pid)
+            job["pid"] = p.pid
+            cancelled = job["cancelled"]
+        if cancelled:
+            # the step was cancelled while the command was starting
+            self._terminate(p.pid)
+        stdout = _Capture(p.stdout, self._capture_, patterns)
+        stderr = _Capture(p.stderr, self._capture_, patterns)
+        expired = threading.Event()
+        timers = []
+        if timeout:
+            def terminate():
+                expired.set()
+                logging.warning(f"{args[0]} timed out after {timeout}s, terminate process group {p.pid}")
+                self._kill(p.pid, signal.SIGTERM)
+            timers = [threading.Timer(timeout, terminate),
+                      threading.Timer(timeout + self._grace_, self._kill, (p.pid, signal.SIGKILL))]
+            [x.start() for x in timers]
+        try:
+            _, status, usage = os.wait4(p.pid, 0)
+        finally:
+            [x.cancel() for x in timers]
+            with self._reaped_:
+                self._groups_.discard(p.pid)
+                self._reaped_.notify_all()
+        p.returncode = os.waitstatus_to_exitcode(status)
+        wall_time = time.monotonic() - ts
+        if expired.is_set():
+            # leftovers of the group may still hold the pipes open
+            self._kill(p.pid, signal.SIGKILL)
+        out, err = stdout.text(self._grace_), stderr.text(self._grace_)
+        fields = {**stderr.fields, **stdout.fields}
+        return CommandResult(p.returncode, out, err, fields, wall_time, usage.ru_utime + usage.ru_stime,
+                             expired.is_set())
+
+    async def run(self, args: list[str], timeout: Optional[float] = None,
+                  parse: Optional[dict[str, str]] = None) -> CommandResult:
+        if self._pool_ is None:
+            self._pool_ = ThreadPoolExecutor(self._concurrency_, thread_name_prefix="command")
+        patterns = {x: re.compile(y) for x, y in (parse or {}).items()}
+        names = ["*"]
+        if os.path.basename(args[0]) in self._per_command_.keys():
+            names.append(os.path.basename(args[0]))
+        loop = asyncio.get_running_loop()
+        job = {"pid": None, "cancelled": False}
+        async with self._limits_.locked(names):
+            try:
+                return await loop.run_in_executor(self._pool_, self._run, args, timeout, patterns, job)
+            except asyncio.CancelledError:
+                # the thread keeps waiting for the command, which has to be stopped
+                with self._reaped_:
+                    job["cancelled"] = True
+                    pid = job["pid"] if job["pid"] in self._groups_ else None
+                if pid:
+                    logging.warning(f"{args[0]} cancelled, terminate process group {pid}")
+                    self._terminate(pid)
+                raise
+
+    def _shutdown(self):
+        # stop running commands, SIGKILL the ones still alive after grace
+        with self._reaped_:
+            groups = list(self._groups_)
+        for item in groups:
+            logging.warning(f"terminate process group {item} on shutdown")
+            self._kill(item, signal.SIGTERM)
+        deadline = time.monotonic() + self._grace_
+        with self._reaped_:
+            while self._groups_ and self._reaped_.wait(max(0.0, deadline - time.monotonic())):
+                pass
+            groups = list(self._groups_)
+        for item in groups:
+            logging.warning(f"process group {item} outlived SIGTERM, kill it")
+            self._kill(item, signal.SIGKILL)
+        if self._pool_:
+            self._pool_.shutdown(wait=False, cancel_futures=True)
+            self._pool_ = None
+
+
+engine = CommandEngine()
@@ -0,0 +1,144 @@
+from collections.abc import MutableMapping
+from typing import Any, Iterator, Mapping, Optional
+
+__all__ = ["Context", "FrozenDict", "FrozenList", "freeze"]
+
+
+class FrozenDict(dict):
+    """dict which refuses to be modified, shared between events without copying"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("frozen dict is read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __hash__(self):
+        return hash(tuple(self.items()))
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __copy__(self):
+        return self
+
+
+class FrozenList(list):
+    """list which refuses to be modified, shared between events without copying"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("frozen list is read-only")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __copy__(self):
+        return self
+
+
+def freeze(value: Any) -> Any:
+    """recursively turn dicts and lists of a config into their frozen counterparts"""
+    if isinstance(value, dict):
+        return FrozenDict((x, freeze(y)) for x, y in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(x) for x in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+_MISSING_ = object()
+_DELETED_ = object()
+
+
+class Context(MutableMapping):
+    """context of an event in a pipeline
+
+    the fixed fields of an event are slots, everything else is written to a private
+    overlay on top of a shared, read-only base (the `context` of a pipeline).
+    deriving a context for another pipeline copies the slots only
+    """
+
+    FIELDS = ("source", "original", "event", "is_dir", "timestamp", "relative_path", "name", "_ok")
+    __slots__ = FIELDS + ("_base_", "_overlay_")
+
+    def __init__(self, base: Optional[Mapping] = None, /, **fields) -> None:
+        self._base_ = base if base is not None else FrozenDict()
+        self._overlay_ = {}
+        for key, value in fields.items():
+            self[key] = value
+
+    def derive(self, base: Optional[Mapping] = None, /, **fields) -> "Context":
+        """a new context with the slots of this one, on top of `base`"""
+        ret = Context(base)
+        for key in self.FIELDS:
+            value = getattr(self, key, _MISSING_)
+            if value is not _MISSING_:
+                setattr(ret, key, value)
+        for key, value in fields.items():
+            ret[key] = value
+        # like dict.update, fields in base override the ones of the event
+        for key in self.FIELDS:
+            if key in ret._base_:
+                setattr(ret, key, ret._base_[key])
+        return ret
+
+    def __getitem__(self, key: str) -> Any:
+        if key in Context.FIELDS:
+            value = getattr(self, key, _MISSING_)
+        else:
+            value = self._overlay_.get(key, _MISSING_)
+            if value is _MISSING_:
+                value = self._base_.get(key, _MISSING_)
+        if value is _MISSING_ or value is _DELETED_:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in Context.FIELDS:
+            setattr(self, key, value)
+        else:
+            self._overlay_[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in Context.FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif key in self._base_:
+            if self._overlay_.get(key, None) is _DELETED_:
+                raise KeyError(key)
+            self._overlay_[key] = _DELETED_
+        else:
+            del self._overlay_[key]
+
+    def __contains__(self, key: object) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        for key in Context.FIELDS:
+            if getattr(self, key, _MISSING_) is not _MISSING_:
+                yield key
+        for key, value in self._overlay_.items():
+            if value is not _DELETED_:
+                yield key
+        for key in self._base_:
+            if key not in self._overlay_ and key not in Context.FIELDS:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
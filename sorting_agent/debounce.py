@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from typing import Any, Callable, Hashable, Optional
+
+__all__ = ["Debouncer"]
+
+
+def _snapshot(path) -> Optional[tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class _Pending():
+    __slots__ = ("path", "payload", "window", "deadline", "snapshot")
+
+    def __init__(self, path, payload, window: float, deadline: float, snapshot) -> None:
+        self.path = path
+        self.payload = payload
+        self.window = window
+        self.deadline = deadline
+        self.snapshot = snapshot
+
+
+class Debouncer():
+    """dispatch a path once its size and mtime have been stable for a window
+
+    pending paths live in a heap of deadlines served by a single loop timer.
+    a follow-up event pushes the deadline back, an expired deadline stats the path
+    and either dispatches it or waits another window if it is still changing.
+    all methods must be called in the loop thread
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, dispatch: Callable[[Any], None],
+                 drop: Optional[Callable[[Any], None]] = None) -> None:
+        self._loop_ = loop
+        self._dispatch_ = dispatch
+        self._drop_ = drop
+        self._pending_: dict[Hashable, _Pending] = {}
+        self._heap_: list[tuple[float, int, Hashable]] = []
+        self._seq_ = itertools.count()
+        self._timer_: Optional[asyncio.TimerHandle] = None
+        self._timer_at_ = None
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._pending_
+
+    def __len__(self) -> int:
+        return len(self._pending_)
+
+    def arm(self, key: Hashable, path, payload: Any, window: float, snapshot=None) -> bool:
+        """arm or re-arm the timer of key, return False if key was already pending"""
+        deadline = self._loop_.time() + window
+        entry = self._pending_.get(key)
+        if entry is not None:
+            entry.deadline = deadline
+            entry.window = max(entry.window, window)
+            self._push(deadline, key)
+            return False
+        if snapshot is None:
+            snapshot = _snapshot(path)
+        self._pending_[key] = _Pending(path, payload, window, deadline, snapshot)
+        self._push(deadline, key)
+        return True
+
+    def _push(self, deadline: float, key: Hashable):
+        heapq.heappush(self._heap_, (deadline, next(self._seq_), key))
+        if self._timer_at_ is None or deadline < self._timer_at_:
+            self._schedule(deadline)
+
+    def _schedule(self, deadline: float):
+        if self._timer_:
+            self._timer_.cancel()
+        self._timer_at_ = deadline
+        self._timer_ = self._loop_.call_at(deadline, self._fire)
+
+    def _fire(self):
+        self._timer_ = None
+        self._timer_at_ = None
+        now = self._loop_.time()
+        while self._heap_ and self._heap_[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap_)
+            entry = self._pending_.get(key)
+            if entry is None or entry.deadline != deadline:
+                # re-armed by a later event, or already dispatched
+                continue
+            snapshot = _snapshot(entry.path)
+            if snapshot is None:
+                logging.debug(f"{entry.path} vanished before settling, dropped")
+                del self._pending_[key]
+                if self._drop_:
+                    self._drop_(entry.payload)
+            elif snapshot != entry.snapshot:
+                logging.debug(f"{entry.path} still changing, wait {entry.window}s more")
+                entry.snapshot = snapshot
+                entry.deadline = now + entry.window
+                heapq.heappush(self._heap_, (entry.deadline, next(self._seq_), key))
+            else:
+                del self._pending_[key]
+                self._dispatch_(entry.payload)
+        if self._heap_:
+            self._schedule(self._heap_[0][0])
+
+    def discard(self, key: Hashable) -> Any:
+        """stop waiting for key, return its payload, None if it is not pending"""
+        entry = self._pending_.pop(key, None)
+        return None if entry is None else entry.payload
+
+    def cancel(self) -> list[Any]:
+        """drop every pending path, return their payloads"""
+        if self._timer_:
+            self._timer_.cancel()
+        self._timer_ = None
+        self._timer_at_ = None
+        payloads = [x.payload for x in self._pending_.values()]
+        self._pending_.clear()
+        self._heap_.clear()
+        return payloads
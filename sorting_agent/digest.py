@@ -0,0 +1,150 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+from typing import Callable, Optional
+from metrics import registry
+from .locks import LockManager
+from .digest_cache import DigestCache
+from .shared import SharedEngine
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+__all__ = ["DigestEngine", "ALGORITHMS", "engine"]
+
+ALGORITHMS: dict[str, Callable] = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+    "blake2s": hashlib.blake2s,
+}
+if xxhash is not None:
+    ALGORITHMS["xxh64"] = xxhash.xxh64
+    ALGORITHMS["xxh3_64"] = xxhash.xxh3_64
+    ALGORITHMS["xxh128"] = xxhash.xxh128
+
+_hashed_ = registry.counter("sorting_hashed_bytes_total", "bytes read to compute digests")
+_cache_ = registry.counter("sorting_digest_cache_total", "lookups of the digest cache", ["result"])
+
+
+class DigestEngine(SharedEngine):
+    """hash files in a thread pool, off the event loop
+
+    every file is read once with readinto into a per-thread buffer, and fed to all
+    requested algorithms. at most `per_device` files are hashed at once on one device.
+    digests found in the cache are returned without reading the file.
+    the cache is written back until the last agent shuts the engine down
+    """
+
+    def __init__(self, workers: int = 4, per_device: int = 1, chunk_size: int = 4 * 1024 * 1024) -> None:
+        super().__init__()
+        self._workers_ = workers
+        self._chunk_size_ = chunk_size
+        self._pool_: Optional[ThreadPoolExecutor] = None
+        # shared by the loops of every agent
+        self._devices_ = LockManager(default=per_device)
+        self._local_ = threading.local()
+        self.cache = DigestCache()
+
+    def configure(self, workers: Optional[int] = None, per_device: Optional[int] = None,
+                  chunk_size: Optional[int] = None,
+                  cache: Optional[str] = None, cache_size: Optional[int] = None) -> None:
+        super().configure(workers=workers, per_device=per_device, chunk_size=chunk_size,
+                          cache=cache, cache_size=cache_size)
+
+    def _configure(self, workers=None, per_device=None, chunk_size=None, cache=None, cache_size=None):
+        if workers:
+            self._workers_ = workers
+        if per_device:
+            self._devices_.configure(default=per_device)
+        if chunk_size:
+            self._chunk_size_ = chunk_size
+        if cache or cache_size:
+            self.cache = DigestCache(self._settings_.get("cache", None), self._settings_.get("cache_size", 65536))
+
+    def volatile(self) -> None:
+        """keep digests in memory only, none are loaded from or written to the cache file"""
+        with self._users_lock_:
+            if self._users_:
+                raise ValueError("DigestEngine is shared by every agent and already running, cannot drop its cache")
+            # a cache file configured later conflicts with this one
+            self._settings_["cache"] = None
+            self.cache = DigestCache(None, self._settings_.get("cache_size", 65536))
+
+    def _open(self):
+        self.cache.open()
+        # the cache counts by itself, read its counters at scrape time
+        _cache_.labels("hit").set_function(lambda: self.cache.hits)
+        _cache_.labels("miss").set_function(lambda: self.cache.misses)
+
+    @staticmethod
+    def check(algorithms: list[str]) -> list[str]:
+        ret = [x.lower() for x in algorithms]
+        for item in ret:
+            if item not in ALGORITHMS.keys():
+                raise NotImplementedError(f"unknown algorithm={item}")
+        return ret
+
+    def _buffer(self) -> memoryview:
+        buffer = getattr(self._local_, "buffer", None)
+        if buffer is None or len(buffer) != self._chunk_size_:
+            buffer = memoryview(bytearray(self._chunk_size_))
+            self._local_.buffer = buffer
+        return buffer
+
+    def hash_file(self, path: str | pathlib.Path, algorithms: list[str]) -> dict[str, str]:
+        """hash a file synchronously, in the calling thread"""
+        hashes = {x: ALGORITHMS[x]() for x in algorithms}
+        buffer = self._buffer()
+        total = 0
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                total += n
+                chunk = buffer[:n]
+                for item in hashes.values():
+                    item.update(chunk)
+        _hashed_.inc(total)
+        return {x: y.hexdigest() for x, y in hashes.items()}
+
+    async def digest(self, path: str | pathlib.Path, algorithms: list[str]) -> dict[str, str]:
+        algorithms = self.check(algorithms)
+        st = os.stat(path)
+        ret = {}
+        for item in algorithms:
+            value = self.cache.get(st, item)
+            if value is not None:
+                ret[item] = value
+        missing = [x for x in algorithms if x not in ret.keys()]
+        if not missing:
+            return ret
+        if self._pool_ is None:
+            self._pool_ = ThreadPoolExecutor(self._workers_, thread_name_prefix="digest")
+        async with self._devices_.locked(str(st.st_dev)):
+            logging.debug(f"hashing {path} with {missing}")
+            loop = asyncio.get_running_loop()
+            hashed = await loop.run_in_executor(self._pool_, self.hash_file, path, missing)
+        # only trust the result if the file did not change while being read
+        if os.stat(path).st_mtime_ns == st.st_mtime_ns:
+            for key, value in hashed.items():
+                self.cache.put(st, key, value)
+        ret.update(hashed)
+        return ret
+
+    def _shutdown(self):
+        if self._pool_:
+            self._pool_.shutdown(wait=False, cancel_futures=True)
+            self._pool_ = None
+        self.cache.close()
+
+
+engine = DigestEngine()
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+import logging
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+__all__ = ["DigestCache"]
+
+_SCHEMA_ = """
+CREATE TABLE IF NOT EXISTS digest (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    value TEXT NOT NULL,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns, algorithm)
+) WITHOUT ROWID
+"""
+
+Key = tuple[int, int, int, int, str]
+
+
+def digest_key(st: os.stat_result, algorithm: str) -> Key:
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, algorithm)
+
+
+class DigestCache():
+    """LRU of digests keyed by (dev, ino, size, mtime_ns, algorithm)
+
+    lookups are served from memory. with a `path`, entries are loaded at `open`
+    and changes are written back in batches by a background thread
+    """
+
+    def __init__(self, path: Optional[str | pathlib.Path] = None, capacity: int = 65536,
+                 batch_size: int = 1024, interval: float = 5.0) -> None:
+        self._path_ = pathlib.Path(path) if path else None
+        self._capacity_ = capacity
+        self._batch_size_ = batch_size
+        self._interval_ = interval
+        self._entries_: OrderedDict[Key, str] = OrderedDict()
+        self._lock_ = threading.Lock()
+        self._queue_: queue.Queue = queue.Queue()
+        self._writer_: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries_)
+
+    def open(self) -> None:
+        if self._path_ is None or self._writer_ is not None:
+            return
+        self._path_.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self._path_)
+        with conn:
+            conn.execute(_SCHEMA_)
+        rows = conn.execute(
+            "SELECT dev, ino, size, mtime_ns, algorithm, value FROM digest ORDER BY used DESC LIMIT ?",
+            (self._capacity_,)).fetchall()
+        conn.close()
+        with self._lock_:
+            for *key, value in reversed(rows):
+                self._entries_[tuple(key)] = value
+        self._writer_ = threading.Thread(target=self._write_loop, name="digest-cache", daemon=True)
+        self._writer_.start()
+        logging.info(f"digest cache {self._path_} opened with {len(rows)} entries")
+
+    def close(self) -> None:
+        if self._writer_ is None:
+            return
+        self._queue_.put(None)
+        self._writer_.join()
+        self._writer_ = None
+        logging.info(f"digest cache {self._path_} closed, hits={self.hits} misses={self.misses}")
+
+    def get(self, st: os.stat_result, algorithm: str) -> Optional[str]:
+        key = digest_key(st, algorithm)
+        with self._lock_:
+            value = self._entries_.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries_.move_to_end(key)
+        self._persist(("put", key, value))
+        return value
+
+    def put(self, st: os.stat_result, algorithm: str, value: str) -> None:
+        key = digest_key(st, algorithm)
+        evicted = []
+        with self._lock_:
+            self._entries_[key] = value
+            self._entries_.move_to_end(key)
+            while len(self._entries_) > self._capacity_:
+                evicted.append(self._entries_.popitem(last=False)[0])
+            self.evictions += len(evicted)
+        self._persist(("put", key, value))
+        for item in evicted:
+            self._persist(("del", item, None))
+
+    def _persist(self, item):
+        if self._writer_ is not None:
+            self._queue_.put(item)
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self._path_)
+        quit = False
+        while not quit:
+            batch = []
+            deadline = time.monotonic() + self._interval_
+            while len(batch) < self._batch_size_:
+                try:
+                    item = self._queue_.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    quit = True
+                    break
+                batch.append(item)
+            if not batch:
+                continue
+            now = time.time_ns()
+            try:
+                with conn:
+                    for op, key, value in batch:
+                        if op == "put":
+                            conn.execute("INSERT OR REPLACE INTO digest VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                         (*key, value, now))
+                        else:
+                            conn.execute("DELETE FROM digest WHERE dev=? AND ino=? AND size=? AND mtime_ns=? "
+                                         "AND algorithm=?", key)
+            except sqlite3.Error as e:
+                logging.error(f"digest cache failed to write {len(batch)} entries: {e}")
+        conn.close()
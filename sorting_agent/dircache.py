@@ -0,0 +1,66 @@
+from collections import OrderedDict
+import logging
+import os
+import pathlib
+import stat
+import threading
+from typing import Optional
+
+__all__ = ["DirCache", "cache"]
+
+
+class DirCache():
+    """process-wide LRU of known directories and their (uid, gid)
+
+    entries are dropped when watchdog reports the directory deleted or moved. output
+    trees are not watched, so mkpath and move drop the entries they find stale
+    """
+
+    def __init__(self, capacity: int = 65536) -> None:
+        self._capacity_ = capacity
+        self._entries_: OrderedDict[pathlib.Path, tuple[int, int]] = OrderedDict()
+        self._lock_ = threading.Lock()
+
+    def __contains__(self, path: pathlib.Path) -> bool:
+        return path in self._entries_
+
+    def __len__(self) -> int:
+        return len(self._entries_)
+
+    def add(self, path: pathlib.Path, uid: int, gid: int) -> None:
+        with self._lock_:
+            self._entries_[path] = (uid, gid)
+            self._entries_.move_to_end(path)
+            if len(self._entries_) > self._capacity_:
+                self._entries_.popitem(last=False)
+
+    def owner(self, path: pathlib.Path) -> Optional[tuple[int, int]]:
+        """(uid, gid) of path, None if it does not exist, only directories are cached"""
+        with self._lock_:
+            ret = self._entries_.get(path)
+            if ret is not None:
+                self._entries_.move_to_end(path)
+                return ret
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if stat.S_ISDIR(st.st_mode):
+            self.add(path, st.st_uid, st.st_gid)
+        return (st.st_uid, st.st_gid)
+
+    def invalidate(self, path: pathlib.Path, recursive: bool = True) -> None:
+        with self._lock_:
+            if self._entries_.pop(path, None) is None and not recursive:
+                return
+            if recursive:
+                for item in [x for x in self._entries_.keys() if x.is_relative_to(path)]:
+                    del self._entries_[item]
+        logging.debug(f"invalidate cached directory {path}")
+
+    def clear(self) -> None:
+        with self._lock_:
+            self._entries_.clear()
+
+
+cache = DirCache()
@@ -0,0 +1,103 @@
+import logging
+import pathlib
+import re
+from fnmatch import translate
+
+__all__ = ["DispatchIndex", "compile_matcher"]
+
+
+class RegexMatcher():
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self._regex_ = re.compile(pattern)
+
+    def match(self, relative_path: pathlib.PurePath) -> bool:
+        return self._regex_.match(str(relative_path)) is not None
+
+    def __repr__(self) -> str:
+        return f"REGEX\"{self.pattern}\""
+
+
+class GlobMatcher():
+    """precompiled equivalent of PurePath.match
+
+    parts of pattern are matched against the tail of path, from right to left
+    """
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        pure = pathlib.PurePath(pattern)
+        if not pure.parts:
+            raise ValueError("empty pattern")
+        self._anchored_ = bool(pure.anchor)
+        self._parts_ = [re.compile(translate(x)) for x in reversed(pure.parts)]
+
+    def match(self, relative_path: pathlib.PurePath) -> bool:
+        parts = relative_path.parts
+        if self._anchored_ and len(parts) != len(self._parts_):
+            return False
+        if len(parts) < len(self._parts_):
+            return False
+        for regex, part in zip(self._parts_, reversed(parts)):
+            if not regex.match(part):
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        return f"GLOB\"{self.pattern}\""
+
+
+def compile_matcher(pipeline: dict):
+    if "re" in pipeline.keys():
+        return RegexMatcher(pipeline["re"])
+    return GlobMatcher(pipeline["glob"])
+
+
+class _Node():
+    __slots__ = ("children", "pipelines")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        self.pipelines: list[tuple[int, dict]] = []
+
+
+class DispatchIndex():
+    """path-prefix trie over the input roots of pipelines
+
+    an event only visits the pipelines whose input is a strict parent of its source,
+    in the order they are declared in config
+    """
+
+    def __init__(self) -> None:
+        self._root_ = _Node()
+        self._size_ = 0
+
+    def add(self, pipeline: dict) -> None:
+        node = self._root_
+        for part in pipeline["input"].parts:
+            node = node.children.setdefault(part, _Node())
+        node.pipelines.append((self._size_, pipeline))
+        self._size_ += 1
+
+    def candidates(self, source: pathlib.PurePath) -> list[tuple[dict, pathlib.PurePath]]:
+        """pipelines whose input contains source, with the relative path of source"""
+        parts = source.parts
+        found = []
+        node = self._root_
+        for depth, part in enumerate(parts):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.pipelines and depth + 1 < len(parts):
+                relative_path = type(source)(*parts[depth + 1:])
+                found.extend((index, pipeline, relative_path) for index, pipeline in node.pipelines)
+        found.sort(key=lambda x: x[0])
+        return [(pipeline, relative_path) for _, pipeline, relative_path in found]
+
+    def match(self, source: pathlib.PurePath, cnt: int = 0):
+        """yield (pipeline, relative_path) of pipelines whose pattern matches source"""
+        for pipeline, relative_path in self.candidates(source):
+            if not pipeline["matcher"].match(relative_path):
+                logging.debug(f"[{cnt}] \"{relative_path}\" unmatched to {pipeline['matcher']}")
+                continue
+            yield pipeline, relative_path
@@ -0,0 +1,141 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import logging
+import threading
+from typing import Iterable, Optional
+
+__all__ = ["LockManager", "manager"]
+
+
+class _Waiter():
+    __slots__ = ("names", "future", "loop", "granted")
+
+    def __init__(self, names: tuple[str, ...], future: asyncio.Future, loop: asyncio.AbstractEventLoop) -> None:
+        self.names = names
+        self.future = future
+        self.loop = loop
+        self.granted = False
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+class LockManager():
+    """named locks, shared by every agent
+
+    a set of names is acquired all at once or not at all, so no order among names can
+    deadlock. waiters are served first come first served: a waiter is granted only when
+    none of its names is wanted by an earlier waiter. a name is a counting semaphore of
+    `limits[name]` holders, or `default` if not listed.
+    waiters sleep on a future of their own loop, woken thread-safely by releases
+    """
+
+    def __init__(self, limits: Optional[dict[str, int]] = None, default: int = 1) -> None:
+        self._mutex_ = threading.Lock()
+        self._limits_: dict[str, int] = {}
+        self._default_ = default
+        self._held_: dict[str, int] = {}
+        self._waiters_: deque[_Waiter] = deque()
+        self.configure(limits)
+
+    def configure(self, limits: Optional[dict[str, int]] = None, default: Optional[int] = None) -> None:
+        with self._mutex_:
+            for name, limit in (limits or {}).items():
+                self._limits_[name.lower()] = int(limit)
+            if default:
+                self._default_ = default
+
+    @staticmethod
+    def normalize(names: Iterable[str] | str) -> tuple[str, ...]:
+        if isinstance(names, str):
+            names = [names]
+        return tuple(sorted({x.lower() for x in names}))
+
+    def _available(self, names: tuple[str, ...]) -> bool:
+        return all(self._held_.get(x, 0) < self._limits_.get(x, self._default_) for x in names)
+
+    def _take(self, names: tuple[str, ...]):
+        for item in names:
+            self._held_[item] = self._held_.get(item, 0) + 1
+
+    def _grant(self):
+        """wake every waiter which may run now, in order, with mutex held"""
+        wanted = set()
+        for waiter in list(self._waiters_):
+            if wanted.isdisjoint(waiter.names) and self._available(waiter.names):
+                self._take(waiter.names)
+                waiter.granted = True
+                self._waiters_.remove(waiter)
+                waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+            wanted.update(waiter.names)
+
+    async def acquire(self, names: Iterable[str] | str, timeout: Optional[float] = None) -> bool:
+        """acquire all of names, return False on timeout"""
+        names = self.normalize(names)
+        loop = asyncio.get_running_loop()
+        with self._mutex_:
+            queued = not all(set(x.names).isdisjoint(names) for x in self._waiters_)
+            if not queued and self._available(names):
+                self._take(names)
+                return True
+            waiter = _Waiter(names, loop.create_future(), loop)
+            self._waiters_.append(waiter)
+        logging.debug(f"wait for locks {names}")
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                return True
+            logging.warning(f"cannot acquire locks {names} in {timeout}s")
+            return False
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release(names)
+            raise
+
+    @asynccontextmanager
+    async def locked(self, names: Iterable[str] | str):
+        """hold names for the body of an async with"""
+        names = self.normalize(names)
+        await self.acquire(names)
+        try:
+            yield
+        finally:
+            self.release(names)
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """leave the queue, return True if the waiter was granted meanwhile"""
+        with self._mutex_:
+            if waiter.granted:
+                return True
+            self._waiters_.remove(waiter)
+            # later waiters may have been held back by this one only
+            self._grant()
+            return False
+
+    def release(self, names: Iterable[str] | str) -> None:
+        names = self.normalize(names)
+        with self._mutex_:
+            for item in names:
+                held = self._held_.get(item, 0)
+                if held == 0:
+                    logging.error(f"named lock \"{item}\" already unlocked")
+                    continue
+                if held == 1:
+                    del self._held_[item]
+                else:
+                    self._held_[item] = held - 1
+            self._grant()
+
+    def held(self, name: str) -> int:
+        return self._held_.get(name.lower(), 0)
+
+    def waiting(self) -> int:
+        return len(self._waiters_)
+
+
+manager = LockManager()
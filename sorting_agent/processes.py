@@ -1,25 +1,29 @@
-from copy import deepcopy
+import copy
 from datetime import datetime
 import functools
 import logging
 import asyncio
-import hashlib
-import shutil
 import os
 import pathlib
 from textwrap import wrap
-import aiofiles
 import shortuuid
 import stat
 from typing import Optional, Set
 from typing import Any
-__all__ = ["ProcessMap"]
+from .digest import engine as digest_engine
+from .transfer import engine as transfer_engine
+from .dircache import cache as dir_cache
+from .command import engine as command_engine
+from .locks import manager as lock_manager
+from .template import render
+__all__ = ["ProcessMap", "ProcessOutputs", "TemplatedProcesses"]
 
 ProcessMap = {}
-
-
-_mutex_locks_ = asyncio.Lock()
-_locks_: dict[str, asyncio.Lock] = {}
+# fields a process adds to the context, as a function of its argument
+ProcessOutputs = {}
+# processes whose string arguments are str.format templates of the context,
+# mapped to the templated keys when their argument is a dict, None for all of them
+TemplatedProcesses = {}
 
 
 def wrapper(func):
@@ -32,6 +36,22 @@ def wrapper(func):
     return f
 
 
+def outputs(*fields: str, dynamic=None):
+    """declare the output fields of a process, `dynamic(arg)` adds the ones depending on arg"""
+    def decorator(func):
+        ProcessOutputs[func.__name__] = lambda arg: set(fields) | (dynamic(arg) if dynamic else set())
+        return func
+    return decorator
+
+
+def templated(func=None, *, keys: Optional[tuple[str, ...]] = None):
+    """declare the string arguments of a process as templates, only `keys` of a dict argument if given"""
+    def decorator(func):
+        TemplatedProcesses[func.__name__] = keys
+        return func
+    return decorator(func) if func else decorator
+
+
 @wrapper
 async def delay(context: dict, arg: float | str) -> dict:
     """delay some time
@@ -55,11 +75,12 @@ def chown_to_parent(context: dict, arg: None) -> dict:
     output: None
     """
     path = context["source"]
-    os.chown(path, path.parent.stat().st_uid, path.parent.stat().st_gid)
+    os.chown(path, *dir_cache.owner(path.parent))
     return context
 
 
 @wrapper
+@templated
 def mkpath(context: dict, arg: str | pathlib.Path) -> dict:
     """make path
 
@@ -69,23 +90,31 @@ def mkpath(context: dict, arg: str | pathlib.Path) -> dict:
     arg: None
     output: None
     """
-    def iter(path: pathlib.Path):
-        if path.exists():
+    def iter(path: pathlib.Path, retry: bool = True):
+        if dir_cache.owner(path) is not None:
             return True
         if path.parent == path:
             return False
-        if not path.parent.exists():
-            if not iter(path.parent):
-                return False
-        os.mkdir(path)
-        os.chown(path, path.parent.stat().st_uid, path.parent.stat().st_gid)
+        if not iter(path.parent):
+            return False
+        owner = dir_cache.owner(path.parent)
+        try:
+            os.mkdir(path)
+        except FileNotFoundError:
+            if not retry:
+                raise
+            # the cached parent was removed outside the agent, output trees are not watched
+            dir_cache.invalidate(path.parent)
+            return iter(path, False)
+        os.chown(path, *owner)
         os.chmod(path, 0o777)
+        dir_cache.add(path, *owner)
         return True
 
-    if isinstance(arg, str):
-        path = pathlib.Path(arg.format(**context))
-    else:
+    if isinstance(arg, pathlib.Path):
         path = arg
+    else:
+        path = pathlib.Path(render(arg, context))
     if not iter(path):
         logging.error(f"cannot make path for {path}")
         context["_ok"] = False
@@ -93,19 +122,33 @@ def mkpath(context: dict, arg: str | pathlib.Path) -> dict:
 
 
 @wrapper
-def move(context: dict, arg: str) -> dict:
+@templated
+@outputs("source", "destination", "transfer_size", "transferred", "transfer_method",
+         "filename", "parent", "relative_parent", "suffix", "stem")
+async def move(context: dict, arg: str) -> dict:
     """move file to destination
 
+    renamed in place on the same filesystem, otherwise copied off the event loop
     input: source, and fields in format argument
     arg: string, with format of destination
-    output: source, destination
+    output: source, destination, transfer_size, transferred, transfer_method
     """
-    context["destination"] = pathlib.Path(arg.format(**context)).absolute().resolve()
+    context["destination"] = pathlib.Path(render(arg, context)).absolute().resolve()
     context = mkpath(context, context["destination"].parent)
-    if context:
-        shutil.move(context["source"], context["destination"])
-    if context:
-        context["source"] = context["destination"]
+    if not context["_ok"]:
+        return context
+    try:
+        context["destination"] = await transfer_engine.move(context["source"], context["destination"], context)
+    except FileNotFoundError:
+        if not context["source"].exists():
+            raise
+        # the cached destination directory was removed behind our back
+        dir_cache.invalidate(context["destination"].parent)
+        context = mkpath(context, context["destination"].parent)
+        if not context["_ok"]:
+            return context
+        context["destination"] = await transfer_engine.move(context["source"], context["destination"], context)
+    context["source"] = context["destination"]
     context = chown_to_parent(context, arg)
     context = parse_filename(context, None)
     return context
@@ -159,6 +202,7 @@ def skip_directory(context: dict, arg: None) -> dict:
 
 
 @wrapper
+@outputs("filename", "parent", "relative_parent", "suffix", "stem")
 def parse_filename(context: dict, arg: None) -> dict:
     """parse file name and get relative information
 
@@ -175,36 +219,26 @@ def parse_filename(context: dict, arg: None) -> dict:
 
 
 @wrapper
-async def digest(context: dict, arg: str) -> dict:
+@outputs("digest", dynamic=lambda arg: {x.lower() for x in ([arg] if isinstance(arg, str) else arg)})
+async def digest(context: dict, arg: str | list[str]) -> dict:
     """calculate digest with file's content
 
+    all algorithms are computed in one pass, off the event loop
     input: source
-    arg: ["md5", "sha1", "sha256"]
-    output: digest, md5 | sha1 | sha256
+    arg: one or a list of ["md5", "sha1", "sha256", "blake2b", "blake2s"], and xxhash's ["xxh64", "xxh3_64", "xxh128"]
+    output: digest (of the first algorithm), md5 | sha1 | sha256 | ...
     """
-    hash = None
-    match arg.lower():
-        case 'md5':
-            hash = hashlib.md5()
-        case 'sha1':
-            hash = hashlib.sha1()
-        case 'sha256':
-            hash = hashlib.sha256()
-        case default:
-            raise NotImplementedError(f"unknown algorithm={arg}")
-    async with aiofiles.open(context['source'], 'rb') as f:
-        while True:
-            buffer = await f.read(16 * 1024 * 1024)
-            if len(buffer) == 0:
-                break
-            logging.debug(f"get {buffer}")
-            hash.update(buffer)
-    context["digest"] = hash.hexdigest()
-    context[arg.lower()] = hash.hexdigest()
+    if isinstance(arg, str):
+        arg = [arg]
+    ret = await digest_engine.digest(context["source"], arg)
+    for key, value in ret.items():
+        context[key] = value
+    context["digest"] = ret[arg[0].lower()]
     return context
 
 
 @wrapper
+@outputs("uuid")
 def generate_uuid(context: dict, arg: int | str) -> dict:
     """generate short uuid
 
@@ -217,41 +251,27 @@ def generate_uuid(context: dict, arg: int | str) -> dict:
 
 
 @wrapper
-async def lock_acquire(context: dict, arg: list[str] | str) -> dict:
-    """acquire named lock
+@outputs("locks")
+async def lock_acquire(context: dict, arg: list[str] | str | dict) -> dict:
+    """acquire named locks, all of them at once
 
+    locks held at the end of the pipeline are released, whether it fails or not
     input: None
-    arg: name of lock, case insensitive
-    output: None
+    arg: name or names of locks, case insensitive, or a dict of
+         names --- name or names of locks
+         timeout --- seconds to wait before failing, optional
+    output: locks
     """
-    if isinstance(arg, str):
-        arg = [arg]
-    arg = [x.lower() for x in arg]
-
-    async with _mutex_locks_:
-        for item in arg:
-            if item not in _locks_.keys():
-                logging.info(f"create new named lock: {item}")
-                _locks_[item] = asyncio.Lock()
-
-    while True:
-        await _mutex_locks_.acquire()
-        for item in arg:
-            if _locks_[item].locked():
-                break
-        else:
-            break
-        _mutex_locks_.release()
-        logging.debug(f"cannot acquire locks")
-        await asyncio.sleep(0)
-
+    options = arg if isinstance(arg, dict) else {"names": arg}
     if "locks" not in context.keys():
         context["locks"] = set()
-    for item in arg:
-        await _locks_[item].acquire()
-        logging.info(f"acquired lock '{item}'")
-        context["locks"].add(item.lower())
-    _mutex_locks_.release()
+    # locks are not reentrant, skip the ones this pipeline already holds
+    names = [x for x in lock_manager.normalize(options["names"]) if x not in context["locks"]]
+    if not await lock_manager.acquire(names, options.get("timeout", None)):
+        context["_ok"] = False
+        return context
+    logging.info(f"acquired locks {names}")
+    context["locks"].update(names)
     return context
 
 
@@ -264,67 +284,84 @@ async def lock_release(context: dict, arg: str | list[str] | None) -> dict:
          None --- release all locked
     output: None
     """
-    async with _mutex_locks_:
-        if isinstance(arg, str):
-            arg = [arg]
-        elif isinstance(arg, list) and len(arg) > 0:
-            pass
-        else:
-            arg: list[str] = context.get("locks", [])
-        arg = [x.lower() for x in arg]
-        logging.debug(f"try to release {arg}")
-
-        for item in arg:
-            try:
-                logging.debug(f"unlock {item}")
-                _locks_[item].release()
-            except KeyError:
-                logging.error(f"named lock \"{arg}\" not found")
-            except RuntimeError:
-                logging.error(f"named lock \"{arg}\" already unlocked")
+    held: set[str] = context.get("locks", set())
+    if isinstance(arg, str):
+        arg = [arg]
+    elif isinstance(arg, list) and len(arg) > 0:
+        pass
+    else:
+        arg = list(held)
+    arg = lock_manager.normalize(arg)
+    logging.debug(f"try to release {arg}")
+
+    for item in arg:
+        if item not in held:
+            logging.error(f"named lock \"{item}\" not held")
+            continue
+        logging.debug(f"unlock {item}")
+        held.discard(item)
+        lock_manager.release(item)
     return context
 
 
 @wrapper
+@templated
 async def publish(context: dict, arg: dict[str, str]) -> dict:
     import dove
-    server = arg["server"]
-    for key in arg.keys():
-        if isinstance(arg[key], str):
-            arg[key] = arg[key].format(**context)
-    logging.info(arg)
-    await dove.publish(server, arg, arg.get("names", None))
+    msg = render(arg, context)
+    logging.info(msg)
+    await dove.publish(msg["server"], msg, msg.get("names", None))
     return context
 
 
+def _execute_outputs(arg) -> set[str]:
+    ret = {"returncode", "stdout", "stderr", "wall_time", "cpu_time"}
+    if isinstance(arg, dict):
+        ret |= set(arg.get("parse", {}).keys())
+    return ret
+
+
 @wrapper
-async def execute(context: dict, arg: list[str]) -> dict:
+@templated(keys=("cmd",))
+@outputs(dynamic=_execute_outputs)
+async def execute(context: dict, arg: list[str] | dict) -> dict:
     """exec extern commands
 
+    output is captured while running, in bounded buffers
     input: dict
-    arg: arugments, first of which is the command
-    output: None
+    arg: arugments, first of which is the command, or a dict of
+         cmd --- the arguments
+         timeout --- seconds before the process group is terminated, optional
+         parse --- {field: regex}, the last line matching regex sets field,
+                   to its first group if any, optional
+    output: returncode, stdout, stderr, wall_time, cpu_time, and fields of parse
     """
-    if (arg is None) or (len(arg) == 0):
+    options = arg if isinstance(arg, dict) else {"cmd": arg}
+    cmd = options.get("cmd", None)
+    if (cmd is None) or (len(cmd) == 0):
         logging.error(f"subprocess_exec's argument is empty")
         context["_ok"] = False
         return context
 
-    arg = [x.format(**context) for x in arg]
-    logging.debug(f"args: {arg}")
-    ts = datetime.now()
-    p = await asyncio.subprocess.create_subprocess_exec(*arg, stdout=asyncio.subprocess.PIPE)
-    ts = datetime.now() - ts
-    context["_ok"] = (await p.wait() == 0)
-    stdout = await p.stdout.readline()
-    logging.info(f"running {arg[0]} consumed {ts.total_seconds():0.6} second(s)")
+    cmd = [render(x, context) for x in cmd]
+    logging.debug(f"args: {cmd}")
+    ret = await command_engine.run(cmd, options.get("timeout", None), options.get("parse", None))
+    context["_ok"] = (ret.returncode == 0) and not ret.timeout
+    context["returncode"] = ret.returncode
+    context["stdout"] = ret.stdout
+    context["stderr"] = ret.stderr
+    context["wall_time"] = ret.wall_time
+    context["cpu_time"] = ret.cpu_time
+    context.update(ret.fields)
+    logging.info(f"running {cmd[0]} consumed {ret.wall_time:0.6} second(s), cpu {ret.cpu_time:0.6} second(s)")
     if not context["_ok"]:
-        logging.error(f"running {arg[0]} failed with return code={p.returncode}, args={' '.join(arg)}")
-    logging.debug(f"stdout:\n{stdout.decode()}")
+        logging.error(f"running {cmd[0]} failed with return code={ret.returncode}, args={' '.join(cmd)}")
+    logging.debug(f"stdout:\n{ret.stdout}")
     return context
 
 
 @wrapper
+@outputs("datetime")
 def get_datetime(context: None, arg: str) -> dict:
     """get date time and format it
 
@@ -338,6 +375,7 @@ def get_datetime(context: None, arg: str) -> dict:
 
 
 @wrapper
+@outputs(dynamic=lambda arg: {arg[1]} if isinstance(arg, list) and len(arg) == 2 else set())
 def copy_field(context: None, arg: list[str]) -> dict:
     """copy field of context
 
@@ -348,5 +386,7 @@ def copy_field(context: None, arg: list[str]) -> dict:
     if (not isinstance(arg, list)) or (len(arg) != 2):
         context["_ok"] = False
         return context
-    context[arg[1]] = deepcopy(context[arg[0]])
+    # frozen values of config are shared, steps like lock_acquire mutate the others in place
+    value = context[arg[0]]
+    context[arg[1]] = copy.copy(value) if isinstance(value, (list, set, dict)) else value
     return context
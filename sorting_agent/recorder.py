@@ -0,0 +1,195 @@
+import logging
+import os
+import pathlib
+import shutil
+import threading
+import time
+from typing import Iterator, Optional
+import msgpack
+from watchdog.events import (FileSystemEvent, FileSystemEventHandler,
+                             DirCreatedEvent, DirDeletedEvent, DirModifiedEvent, DirMovedEvent,
+                             FileClosedEvent, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent)
+
+__all__ = ["Recorder", "Replayer", "read"]
+
+FORMAT = "sorting-agent-events"
+VERSION = 1
+
+# (event type, is_dir) -> event class of watchdog
+_EVENTS_ = {
+    ("created", False): FileCreatedEvent,
+    ("created", True): DirCreatedEvent,
+    ("deleted", False): FileDeletedEvent,
+    ("deleted", True): DirDeletedEvent,
+    ("modified", False): FileModifiedEvent,
+    ("modified", True): DirModifiedEvent,
+    ("moved", False): FileMovedEvent,
+    ("moved", True): DirMovedEvent,
+    ("closed", False): FileClosedEvent,
+}
+
+
+class Recorder():
+    """append watchdog events to a rotating msgpack file
+
+    every record is [monotonic time, event type, source, destination or None, is_dir],
+    after a header map. the file is rotated like logging.handlers.RotatingFileHandler,
+    to path.1 ... path.`backups`, once it grows over `max_bytes`
+    """
+
+    def __init__(self, path: str | pathlib.Path, max_bytes: int = 64 * 1024 * 1024, backups: int = 5,
+                 interval: float = 1.0) -> None:
+        self._path_ = pathlib.Path(path)
+        self._max_bytes_ = max_bytes
+        self._backups_ = backups
+        self._interval_ = interval
+        self._lock_ = threading.Lock()
+        self._packer_ = msgpack.Packer()
+        self._file_ = None
+        self._size_ = 0
+        self._flushed_ = 0.0
+
+    def open(self) -> None:
+        self._path_.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock_:
+            self._open()
+        logging.info(f"record events to {self._path_}")
+
+    def _open(self):
+        self._file_ = open(self._path_, "ab")
+        header = self._packer_.pack({"format": FORMAT, "version": VERSION,
+                                     "time": time.time(), "monotonic": time.monotonic()})
+        self._file_.write(header)
+        self._size_ = self._file_.tell()
+
+    def _rotate(self):
+        self._file_.close()
+        for i in range(self._backups_ - 1, 0, -1):
+            source = self._path_.with_name(f"{self._path_.name}.{i}")
+            if source.exists():
+                os.replace(source, self._path_.with_name(f"{self._path_.name}.{i + 1}"))
+        if self._backups_ > 0:
+            os.replace(self._path_, self._path_.with_name(f"{self._path_.name}.1"))
+        else:
+            self._path_.unlink()
+        self._open()
+
+    def record(self, event: FileSystemEvent) -> None:
+        now = time.monotonic()
+        data = self._packer_.pack([now, event.event_type, event.src_path,
+                                   getattr(event, "dest_path", None) or None, event.is_directory])
+        with self._lock_:
+            if self._file_ is None:
+                return
+            self._file_.write(data)
+            self._size_ += len(data)
+            if self._size_ >= self._max_bytes_:
+                self._rotate()
+            elif now - self._flushed_ >= self._interval_:
+                self._file_.flush()
+                self._flushed_ = now
+
+    def close(self) -> None:
+        with self._lock_:
+            if self._file_:
+                self._file_.close()
+                self._file_ = None
+
+
+def read(path: str | pathlib.Path) -> Iterator[list]:
+    """records of a recording, rotated files first when path is the current one"""
+    path = pathlib.Path(path)
+    rotated = [x for x in path.parent.glob(f"{path.name}.*") if x.suffix[1:].isdigit()]
+    # path.1 is the newest of the rotated ones
+    files = sorted(rotated, key=lambda x: int(x.suffix[1:]), reverse=True)
+    if path.exists():
+        files.append(path)
+    for item in files:
+        with open(item, "rb") as f:
+            for record in msgpack.Unpacker(f, raw=False):
+                if isinstance(record, dict):
+                    if record.get("format", None) != FORMAT:
+                        raise ValueError(f"{item} is not a recording of events")
+                    continue
+                yield record
+
+
+class Replayer():
+    """feed recorded events to an event handler, in real time or as fast as possible
+
+    `mapping` rewrites path prefixes, to replay against a sandbox tree. events outside
+    of it are skipped, so the recorded paths are never handled. with `materialize`,
+    every event is applied to the sandbox first, so pipelines find the files it refers to
+    """
+
+    def __init__(self, handler: FileSystemEventHandler, speed: float = 1.0,
+                 mapping: Optional[dict[str, str]] = None, materialize: bool = False) -> None:
+        self._handler_ = handler
+        self._speed_ = speed
+        # longest prefixes first
+        self._mapping_ = sorted((mapping or {}).items(), key=lambda x: -len(x[0]))
+        self._materialize_ = materialize
+        self.events = 0
+        self.skipped = 0
+        self.lag = 0.0
+
+    def _map(self, path: Optional[str]) -> tuple[Optional[str], bool]:
+        if path is None:
+            return None, False
+        for old, new in self._mapping_:
+            if path == old or path.startswith(old.rstrip(os.sep) + os.sep):
+                return new + path[len(old.rstrip(os.sep)):], True
+        return path, False
+
+    def _apply(self, type: str, source: pathlib.Path, destination: Optional[pathlib.Path], is_dir: bool):
+        try:
+            if type == "created" or (type == "modified" and not is_dir):
+                if is_dir:
+                    source.mkdir(parents=True, exist_ok=True)
+                else:
+                    source.parent.mkdir(parents=True, exist_ok=True)
+                    with open(source, "ab") as f:
+                        # the size changes, so the debouncer sees the file still being written
+                        if type == "modified":
+                            f.write(b"\0")
+            elif type == "moved" and destination and source.exists():
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(source, destination)
+            elif type == "deleted":
+                if is_dir:
+                    shutil.rmtree(source, ignore_errors=True)
+                else:
+                    source.unlink(missing_ok=True)
+        except OSError as e:
+            logging.debug(f"cannot apply {type} of {source}: {e}")
+
+    def replay(self, records) -> None:
+        start = None
+        last = None
+        for t, type, source, destination, is_dir in records:
+            # monotonic time restarts with the machine, so does the replay
+            if start is None or t < last:
+                start = (t, time.monotonic())
+            last = t
+            if self._speed_ > 0:
+                delay = start[1] + (t - start[0]) / self._speed_ - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.lag = max(self.lag, -delay)
+            cls = _EVENTS_.get((type, bool(is_dir)), None)
+            if cls is None:
+                self.skipped += 1
+                continue
+            source, mapped = self._map(source)
+            if destination is not None:
+                destination, moved = self._map(destination)
+                mapped = mapped and moved
+            if self._mapping_ and not mapped:
+                self.skipped += 1
+                continue
+            if self._materialize_:
+                self._apply(type, pathlib.Path(source), pathlib.Path(destination) if destination else None, is_dir)
+            event = cls(source, destination) if type == "moved" else cls(source)
+            self._handler_.dispatch(event)
+            self.events += 1
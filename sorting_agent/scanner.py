@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+from typing import Callable, Optional
+
+__all__ = ["Scanner"]
+
+
+class Scanner():
+    """walk directory trees concurrently with os.scandir
+
+    every directory is scanned by a task of the pool, its subdirectories become new tasks.
+    entries are handed to `emit` in batches of (path, is_dir, stat), the directory itself
+    last. files are stated in the pool, stat is None for directories and vanished files.
+    `prune(path)` skips a directory and everything below it,
+    `accept(path, entry)` filters entries, `entry` is None for the scanned directory itself
+    """
+
+    def __init__(self,
+                 emit: Callable[[list[tuple[str, bool, Optional[os.stat_result]]]], None],
+                 prune: Optional[Callable[[str], bool]] = None,
+                 accept: Optional[Callable[[str, Optional[os.DirEntry]], bool]] = None,
+                 workers: int = 8,
+                 batch_size: int = 256,
+                 stopped: Optional[threading.Event] = None) -> None:
+        self._emit_ = emit
+        self._prune_ = prune
+        self._accept_ = accept
+        self._workers_ = workers
+        self._batch_size_ = batch_size
+        self._stopped_ = stopped or threading.Event()
+        self._pool_: Optional[ThreadPoolExecutor] = None
+        self._outstanding_ = 0
+        self._lock_ = threading.Lock()
+        self._done_ = threading.Event()
+
+    @staticmethod
+    def roots(paths) -> list[str]:
+        """deduplicated roots, without the ones nested in another root"""
+        ret = []
+        for item in sorted(set(str(x) for x in paths)):
+            if ret and (item == ret[-1] or item.startswith(ret[-1].rstrip(os.sep) + os.sep)):
+                continue
+            ret.append(item)
+        return ret
+
+    def scan(self, paths) -> None:
+        """scan all roots, blocks until finished or stopped"""
+        roots = self.roots(paths)
+        if not roots:
+            return
+        self._done_.clear()
+        with ThreadPoolExecutor(self._workers_, thread_name_prefix="scanner") as pool:
+            self._pool_ = pool
+            for item in roots:
+                self._submit(item)
+            self._done_.wait()
+        self._pool_ = None
+
+    def _submit(self, path: str):
+        with self._lock_:
+            self._outstanding_ += 1
+        self._pool_.submit(self._scan_dir, path)
+
+    def _finish(self):
+        with self._lock_:
+            self._outstanding_ -= 1
+            if self._outstanding_ == 0:
+                self._done_.set()
+
+    def _flush(self, batch: list):
+        if batch:
+            self._emit_(batch)
+
+    def _stat(self, entry: os.DirEntry) -> Optional[os.stat_result]:
+        # cached by the entry, accept may have asked for it already
+        try:
+            return entry.stat()
+        except OSError:
+            return None
+
+    def _scan_dir(self, path: str):
+        try:
+            if self._stopped_.is_set():
+                return
+            batch = []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir():
+                                # like os.walk, symlinks to directories are neither followed nor reported
+                                if entry.is_symlink():
+                                    continue
+                                if self._prune_ and self._prune_(entry.path):
+                                    logging.debug(f"prune {entry.path}")
+                                    continue
+                                self._submit(entry.path)
+                            elif self._accept_ is None or self._accept_(entry.path, entry):
+                                batch.append((entry.path, False, self._stat(entry)))
+                                if len(batch) >= self._batch_size_:
+                                    self._flush(batch)
+                                    batch = []
+                        except OSError as e:
+                            logging.warning(f"cannot scan {entry.path}: {e}")
+            except OSError as e:
+                logging.warning(f"cannot scan {path}: {e}")
+            if self._accept_ is None or self._accept_(path, None):
+                batch.append((path, True, None))
+            self._flush(batch)
+        except Exception as e:
+            logging.critical(f"scanning {path} failed: {e}")
+        finally:
+            self._finish()
@@ -0,0 +1,151 @@
+import asyncio
+from collections import Counter, deque
+import contextlib
+from contextvars import ContextVar
+import heapq
+import itertools
+import logging
+import threading
+import traceback
+from typing import Awaitable, Callable, Optional
+
+__all__ = ["Scheduler", "PRIORITY_EVENT", "PRIORITY_INITIALIZE"]
+
+PRIORITY_EVENT = 0
+PRIORITY_INITIALIZE = 1
+
+
+class Scheduler():
+    """bounded priority queue between SortingAgent.push and the pipelines
+
+    every priority class owns `queue_size` slots. a producer thread blocks in `acquire`
+    until a slot of its class is free, which pushes back on the observer and the scanner.
+    `concurrency` workers consume jobs, live events first.
+    `route(context)` names the pipeline a job runs first. a job whose pipeline is at its
+    limit is parked instead of holding a worker, and queued again once a run of that
+    pipeline ends
+    """
+
+    def __init__(self,
+                 loop: asyncio.AbstractEventLoop,
+                 handler: Callable[[dict], Awaitable[None]],
+                 queue_size: int = 1024,
+                 concurrency: int = 8,
+                 route: Optional[Callable[[dict], Optional[str]]] = None) -> None:
+        self._loop_ = loop
+        self._handler_ = handler
+        self._concurrency_ = concurrency
+        self._route_ = route
+        self._slots_ = {
+            PRIORITY_EVENT: threading.BoundedSemaphore(queue_size),
+            PRIORITY_INITIALIZE: threading.BoundedSemaphore(queue_size),
+        }
+        self._queue_ = asyncio.PriorityQueue()
+        self._seq_ = itertools.count()
+        self._pipeline_limits_: dict[str, int] = {}
+        self._running_: Counter[str] = Counter()
+        self._parked_: dict[str, list[tuple]] = {}
+        self._waiters_: dict[str, deque[asyncio.Future]] = {}
+        # the pipeline whose run the worker of the current task has counted
+        self._reserved_: ContextVar[Optional[str]] = ContextVar("reserved", default=None)
+        self._workers_: list[asyncio.Task] = []
+
+    def set_pipeline_limit(self, name: str, limit: int | None) -> None:
+        if limit:
+            self._pipeline_limits_[name] = limit
+            self._parked_[name] = []
+
+    def _saturated(self, name: Optional[str]) -> bool:
+        return name in self._pipeline_limits_ and self._running_[name] >= self._pipeline_limits_[name]
+
+    def _enter(self, name: Optional[str]):
+        if name in self._pipeline_limits_:
+            self._running_[name] += 1
+
+    def _leave(self, name: Optional[str]):
+        if name not in self._pipeline_limits_:
+            return
+        self._running_[name] -= 1
+        waiters = self._waiters_.get(name, None)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+        if self._parked_[name]:
+            self._queue_.put_nowait(heapq.heappop(self._parked_[name]))
+
+    @contextlib.asynccontextmanager
+    async def pipeline(self, name: str):
+        """limit concurrent runs of a pipeline, if configured
+
+        the run a worker routed its job to is already counted and ends with this block,
+        so a job failing over does not hold it. only the pipelines tried after it wait here
+        """
+        if self._reserved_.get() == name:
+            try:
+                yield
+            finally:
+                self._reserved_.set(None)
+                self._leave(name)
+            return
+        if name not in self._pipeline_limits_:
+            yield
+            return
+        while self._saturated(name):
+            waiter = self._loop_.create_future()
+            self._waiters_.setdefault(name, deque()).append(waiter)
+            await waiter
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._leave(name)
+
+    def acquire(self, priority: int, timeout: float | None = None) -> bool:
+        """reserve a slot, blocks the calling thread, so never call it in the loop thread"""
+        return self._slots_[priority].acquire(timeout=timeout)
+
+    def release(self, priority: int) -> None:
+        self._slots_[priority].release()
+
+    def put(self, context: dict, priority: int) -> None:
+        """queue a job, must be called in the loop thread holding a slot of `priority`"""
+        name = self._route_(context) if self._route_ else None
+        self._queue_.put_nowait((priority, next(self._seq_), name, context))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue_.get()
+            priority, _, name, context = job
+            if self._saturated(name):
+                # keeps its slot and its place among the parked jobs of the pipeline
+                heapq.heappush(self._parked_[name], job)
+                self._queue_.task_done()
+                continue
+            self._enter(name)
+            self._reserved_.set(name)
+            try:
+                await self._handler_(context)
+            except Exception:
+                logging.critical(traceback.format_exc())
+            finally:
+                # still reserved if the job never ran its routed pipeline
+                if self._reserved_.get() == name:
+                    self._reserved_.set(None)
+                    self._leave(name)
+                self._queue_.task_done()
+                self.release(priority)
+
+    def start(self) -> None:
+        """start workers on the loop"""
+        self._workers_ = [self._loop_.create_task(self._worker()) for _ in range(self._concurrency_)]
+
+    async def stop(self) -> None:
+        for item in self._workers_:
+            item.cancel()
+        await asyncio.gather(*self._workers_, return_exceptions=True)
+        self._workers_ = []
+
+    def qsize(self) -> int:
+        return self._queue_.qsize() + sum(len(x) for x in self._parked_.values())
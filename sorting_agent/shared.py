@@ -0,0 +1,61 @@
+import threading
+from typing import Any
+
+__all__ = ["SharedEngine"]
+
+
+class SharedEngine():
+    """base of the process-wide engines, shared by every agent
+
+    settings of every agent are merged. a setting given twice with different values is
+    rejected, so is any new setting once the engine is in use. `open` and `shutdown`
+    are counted, resources are only released by the last user, which also forgets
+    the settings for the next agents
+    """
+
+    def __init__(self) -> None:
+        self._settings_: dict[str, Any] = {}
+        self._users_ = 0
+        self._users_lock_ = threading.Lock()
+
+    def configure(self, **kwargs) -> None:
+        with self._users_lock_:
+            given = {x: y for x, y in kwargs.items() if y is not None}
+            conflicts = sorted(x for x, y in given.items() if x in self._settings_ and self._settings_[x] != y)
+            if conflicts:
+                raise ValueError(f"{type(self).__name__} is shared by every agent, {', '.join(conflicts)} "
+                                 f"conflicts with {', '.join(f'{x}={self._settings_[x]}' for x in conflicts)}")
+            changed = {x: y for x, y in given.items() if x not in self._settings_}
+            if changed and self._users_:
+                raise ValueError(f"{type(self).__name__} is shared by every agent and already running, "
+                                 f"cannot set {', '.join(sorted(changed))}")
+            self._settings_.update(changed)
+        if changed:
+            self._configure(**changed)
+
+    def open(self) -> None:
+        with self._users_lock_:
+            self._users_ += 1
+            first = self._users_ == 1
+        if first:
+            self._open()
+
+    def shutdown(self) -> None:
+        with self._users_lock_:
+            if self._users_ == 0:
+                return
+            self._users_ -= 1
+            last = self._users_ == 0
+            if last:
+                self._settings_ = {}
+        if last:
+            self._shutdown()
+
+    def _configure(self, **kwargs) -> None:
+        pass
+
+    def _open(self) -> None:
+        pass
+
+    def _shutdown(self) -> None:
+        pass
@@ -1,4 +1,3 @@
-from copy import deepcopy
 import os
 from datetime import datetime
 import threading
@@ -9,41 +8,108 @@ from watchdog.events import FileSystemEventHandler, FileSystemEvent
 from watchdog.observers import Observer
 from time import sleep
 import yaml
-from .processes import ProcessMap
-import re
+from typing import Callable, Optional
+from .processes import ProcessMap, ProcessOutputs, TemplatedProcesses
+from .template import compile_templates, fields_of
+from .dispatch import DispatchIndex, compile_matcher
+from .blacklist import Blacklist
+from .scheduler import Scheduler, PRIORITY_EVENT, PRIORITY_INITIALIZE
+from .debounce import Debouncer
+from .scanner import Scanner
+from .digest import engine as digest_engine
+from .transfer import engine as transfer_engine
+from .dircache import cache as dir_cache
+from .command import engine as command_engine
+from .locks import manager as lock_manager
+from .context import Context, freeze
+from .state import StateIndex, OUTCOME_SUCCESS, OUTCOME_FAILURE, OUTCOME_UNMATCHED
+from .trace import Trace, Tracer
+from .batch import Summary, plan, OUTCOME_PLANNED
+from .recorder import Recorder
+import hashlib
+import json
+import itertools
+import time
 import traceback
-from fnmatch import fnmatch
+from metrics import registry
 
 __all__ = ["SortingAgent"]
 
+_queue_depth_ = registry.gauge("sorting_queue_depth", "events waiting for a worker", ["agent"])
+_in_flight_ = registry.gauge("sorting_in_flight", "events pending or running", ["agent"])
+_debounce_pending_ = registry.gauge("sorting_debounce_pending", "events waiting to settle", ["agent"])
+_debounce_dropped_ = registry.counter("sorting_debounce_dropped_total",
+                                      "events merged into a pending or running one, or vanished", ["agent", "reason"])
+_events_ = registry.counter("sorting_events_total", "handled events by outcome", ["agent", "outcome"])
+_pipeline_seconds_ = registry.histogram("sorting_pipeline_seconds", "time to run a pipeline", ["pipeline", "ok"])
+_step_seconds_ = registry.histogram("sorting_step_seconds", "time to run a process step", ["step"])
+_filtered_ = registry.counter("sorting_events_filtered_total",
+                              "watchdog events no pipeline takes, dropped in the observer thread", ["agent"])
+
 
 class Handler(FileSystemEventHandler):
+    """hand the events of watched inputs to an agent
+
+    events are filtered in the observer thread by the pipelines of the agent, the rest is
+    pushed in batches, flushed once the queue of the observer is drained or `batch_size`
+    events are kept. without an observer every event is pushed at once
+    """
+
     _agent_ = None
     _observer_ = None
 
-    def __init__(self, observer, agent):
+    def __init__(self, observer, agent, recorder: Recorder | None = None, batch_size: int = 256):
         self._observer_ = observer
         self._agent_ = agent
+        self._recorder_ = recorder
+        self._batch_size_ = batch_size
+        self._batch_: list[dict] = []
+        self._filtered_ = _filtered_.labels(agent.name)
+
+    def dispatch(self, event: FileSystemEvent):
+        super().dispatch(event)
+        if self._batch_ and (self._observer_ is None or len(self._batch_) >= self._batch_size_
+                             or self._observer_.event_queue.empty()):
+            self.flush()
+
+    def flush(self) -> None:
+        batch, self._batch_ = self._batch_, []
+        self._agent_.push_batch(batch)
 
-    def _format_and_push_event_(self, event: FileSystemEvent):
-        context = {}
-        context["source"] = pathlib.Path(event.src_path).absolute().resolve()
-        context["event"] = event.event_type
-        context["is_dir"] = event.is_directory
-        if self._agent_:
-            self._agent_.push(context)
+    def on_any_event(self, event: FileSystemEvent):
+        if self._recorder_:
+            self._recorder_.record(event)
+
+    def _add(self, path: str, type: str, is_dir: bool):
+        # inputs are resolved, so are the paths watchdog reports under them
+        source = pathlib.Path(path)
+        if type == "deleted" and is_dir:
+            # pending events under the directory are dropped, whatever pipelines they matched
+            wanted = self._agent_.watched(source)
+        else:
+            wanted = self._agent_.wanted(source)
+        if not wanted:
+            self._filtered_.inc()
+            return
+        logging.debug(f"{path} {type} dir={is_dir}")
+        self._batch_.append({"source": source, "event": type, "is_dir": is_dir})
+
+    def on_created(self, event: FileSystemEvent):
+        # files in a new directory may be written before it is watched, watchdog reports them as created
+        self._add(event.src_path, "created", event.is_directory)
 
     def on_modified(self, event: FileSystemEvent):
-        logging.debug(
-            "{} modified dir={} is_synthetic={}".format(
-                event.src_path,
-                event.is_directory,
-                event.is_synthetic))
-        self._format_and_push_event_(event)
+        self._add(event.src_path, "modified", event.is_directory)
 
     def on_moved(self, event: FileSystemEvent):
-        logging.debug("{} moved dir={} is_synthetic={}".format(event.src_path, event.is_directory, event.is_synthetic))
-        self._format_and_push_event_(event)
+        if event.is_directory:
+            dir_cache.invalidate(pathlib.Path(event.src_path))
+        self._add(event.src_path, "deleted", event.is_directory)
+        self._add(event.dest_path, "moved", event.is_directory)
+
+    def on_deleted(self, event: FileSystemEvent):
+        dir_cache.invalidate(pathlib.Path(event.src_path), event.is_directory)
+        self._add(event.src_path, "deleted", event.is_directory)
 
 
 class SortingAgent(threading.Thread):
@@ -53,11 +119,33 @@ class SortingAgent(threading.Thread):
         self._event_quit_ = asyncio.Event()
         self._event_quit_.clear()
         self._observer_ = Observer()
-        self._mutex_ = threading.Lock()
+        self._stopped_ = threading.Event()
+        self._scheduler_ = Scheduler(self._loop_, self._async_handle, route=self._route)
+        self._debouncer_ = Debouncer(self._loop_, self._dispatch, self._drop)
+        self._debounce_ = 1.0
+        self._state_: StateIndex | None = None
+        self._tracer_: Tracer | None = None
+        self._recorder_: Recorder | None = None
+        self._watch_ = True
+        self._scheduler_cfg_ = {}
+        self._scanner_cfg_ = {}
+        self._dry_run_ = False
+        self._summary_: Summary | None = None
+        self._report_: Callable[[str], None] = lambda x: logging.info(f"[dry-run] {x}")
+        self._engines_ = []
         self._pipelines_ = []
+        self._index_ = DispatchIndex()
+        self._blacklists_: dict[tuple[str, ...], Blacklist] = {}
         self._current_tasks_ = {}
         self._cnt_ = 0
         self._init_scan_ = []
+        # read at scrape time only, nothing to update per event
+        _queue_depth_.labels(self.name).set_function(lambda: self._scheduler_.qsize())
+        _in_flight_.labels(self.name).set_function(lambda: len(self._current_tasks_))
+        _debounce_pending_.labels(self.name).set_function(lambda: len(self._debouncer_))
+        self._dropped_ = {x: _debounce_dropped_.labels(self.name, x) for x in ("pending", "running", "vanished")}
+        self._outcomes_ = {x: _events_.labels(self.name, x)
+                           for x in ("success", "failure", "unmatched", OUTCOME_PLANNED)}
 
     def load_config(self, path):
         raw = None
@@ -65,6 +153,14 @@ class SortingAgent(threading.Thread):
         with open(path, "r") as f:
             raw = yaml.load(f, Loader=yaml.SafeLoader)
         try:
+            self._scheduler_cfg_ = raw.get("scheduler", {})
+            self._scheduler_ = Scheduler(self._loop_, self._async_handle, route=self._route, **self._scheduler_cfg_)
+            self._debounce_ = float(raw.get("debounce", self._debounce_))
+            self._scanner_cfg_ = raw.get("scanner", {})
+            digest_engine.configure(**raw.get("digest", {}))
+            transfer_engine.configure(**raw.get("transfer", {}))
+            command_engine.configure(**raw.get("execute", {}))
+            lock_manager.configure(raw.get("locks", {}))
             for item in raw["pipelines"]:
                 temp = {}
                 temp["name"] = item["name"]
@@ -77,52 +173,230 @@ class SortingAgent(threading.Thread):
                     temp["glob"] = item["glob"]
                 else:
                     temp["re"] = item["re"]
+                temp["matcher"] = compile_matcher(temp)
                 temp["process"] = []
                 temp["input"] = pathlib.Path(item["input"]).absolute().resolve()
-                temp["context"] = item.get("context", {})
-                temp["blacklist"] = item.get("blacklist", [])
-                temp["process"] = item["process"]
-                for i in temp["process"]:
-                    if i["type"] not in ProcessMap.keys():
-                        raise KeyError(f"invalid process '{i['type']}'")
-                temp["failure"] = item.get("failure", [])
-                for i in temp["failure"]:
-                    if i["type"] not in ProcessMap.keys():
-                        raise KeyError(f"invalid process '{i['type']}'")
+                temp["context"] = freeze(item.get("context", {}))
+                temp["blacklist"] = self._compile_blacklist(item.get("blacklist", []))
+                available = set(Context.FIELDS) | set(temp["context"].keys())
+                temp["process"] = self._compile_steps(temp["name"], item["process"], available)
+                temp["debounce"] = float(item.get("debounce", self._debounce_))
+                # failure may happen at any step, so it can use fields of any of them
+                temp["failure"] = self._compile_steps(temp["name"], item.get("failure", []), available)
+                temp["concurrency"] = item.get("concurrency", None)
+                # label children are looked up once, not for every run
+                temp["seconds"] = {x: _pipeline_seconds_.labels(temp["name"], x) for x in ("true", "false")}
+                self._scheduler_.set_pipeline_limit(temp["name"], temp["concurrency"])
                 self._pipelines_.append(temp)
+                self._index_.add(temp)
                 self._init_scan_.append(temp["input"])
                 logging.debug(temp)
+            if raw.get("state", None):
+                generation = hashlib.sha1(json.dumps(raw["pipelines"], sort_keys=True, default=str).encode())
+                self._state_ = StateIndex(raw["state"], generation.hexdigest())
+            if raw.get("trace", None):
+                self._tracer_ = Tracer(**raw["trace"])
+            if raw.get("record", None):
+                self._recorder_ = Recorder(**raw["record"])
         except KeyError as e:
             logging.critical(f"parse config failed: Key {e} not found")
             raise e
+        except ValueError as e:
+            logging.critical(f"parse config failed: {e}")
+            raise e
         logging.debug(self._pipelines_)
 
+    def detach(self) -> Handler:
+        """run without observer and initial scan, events only come from the returned handler
+
+        such events are replayed, often against a sandbox. they must not settle files in
+        the state index of the watched inputs, nor write its traces and digest cache
+        """
+        self._watch_ = False
+        self._state_ = None
+        self._tracer_ = None
+        digest_engine.volatile()
+        return Handler(None, self)
+
     def run(self):
-        for item in self._pipelines_:
-            logging.info(f"{item['name']}: monitor {item['input']}")
-            self._observer_.schedule(Handler(self._observer_, self), item["input"], True)
+        if self._watch_:
+            # one handler for every input, so a batch never waits for events of another watch
+            handler = Handler(self._observer_, self, self._recorder_)
+            for item in self._pipelines_:
+                logging.info(f"{item['name']}: monitor {item['input']}")
+                self._observer_.schedule(handler, item["input"], True)
 
-        self._observer_.start()
+        if self._state_:
+            self._state_.open()
+        if self._tracer_:
+            self._tracer_.open()
+        if self._recorder_ and self._watch_:
+            self._recorder_.open()
+        self._open_engines()
         asyncio.set_event_loop(self._loop_)
-        logging.info("start initial scanning")
-        for item in self._init_scan_:
-            for root, _, files in os.walk(item):
-                for file in files:
-                    self.push({
-                        "source": pathlib.Path(os.path.join(root, file)).absolute().resolve(),
-                        "event": "initialize",
-                        "is_dir": False,
-                    })
-                self.push({
-                    "source": pathlib.Path(root).absolute().resolve(),
-                    "event": "initialize",
-                    "is_dir": True
-                })
+        self._scheduler_.start()
+        if self._watch_:
+            self._observer_.start()
+            scanner = threading.Thread(target=self._initial_scan, name=f"{self.name}-scan", daemon=True)
+            scanner.start()
         logging.info("agent started")
         self._loop_.run_until_complete(self._event_quit_.wait())
+        self._shutdown()
         logging.info("agent stopped")
-        self._observer_.stop()
-        self._observer_.join()
+        if self._watch_:
+            self._observer_.stop()
+            self._observer_.join()
+        if self._recorder_:
+            self._recorder_.close()
+        if self._state_:
+            self._state_.close()
+        if self._tracer_:
+            self._tracer_.close()
+
+    def without(self, type: str) -> None:
+        """remove steps of a type from every pipeline, before the agent runs"""
+        for item in self._pipelines_:
+            item["process"] = freeze([x for x in item["process"] if x["type"] != type])
+            item["failure"] = freeze([x for x in item["failure"] if x["type"] != type])
+
+    def collect(self) -> Summary:
+        """summarize outcomes of the events handled from now on"""
+        self._summary_ = Summary()
+        return self._summary_
+
+    def wait_idle(self, interval: float = 0.1) -> None:
+        """block until every event pushed so far is handled, never call it in the loop thread"""
+        # pushes reach the loop in order, so they are all armed once this returns
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), self._loop_).result()
+        while self._current_tasks_:
+            sleep(interval)
+
+    def _shutdown(self):
+        self._stopped_.set()
+        self._debouncer_.cancel()
+        self._loop_.run_until_complete(self._scheduler_.stop())
+        self._loop_.run_until_complete(self._async_close_publishers())
+        for item in self._engines_:
+            item.shutdown()
+        self._engines_ = []
+
+    def _open_engines(self):
+        # shared by every agent, each one shuts down only what it opened
+        self._engines_ = [digest_engine, transfer_engine, command_engine]
+        for item in self._engines_:
+            item.open()
+
+    def sort(self, pipelines: Optional[list[str]] = None, jobs: Optional[int] = None,
+             dry_run: bool = False, publish: bool = True,
+             report: Optional[Callable[[str], None]] = None) -> Summary:
+        """sort the inputs once, without debounce and observer, in the calling thread
+
+        pipelines --- names of pipelines to run, all of them if empty
+        jobs --- events handled at once, concurrency of the scheduler if None
+        dry_run --- match and render the steps, but run none of them, nor write any file
+        publish --- keep publish steps, which need a running Dove
+        report --- receives the plan of every file in a dry run, logged at info if None
+        """
+        if pipelines:
+            unknown = set(pipelines) - {x["name"] for x in self._pipelines_}
+            if unknown:
+                raise ValueError(f"pipeline {', '.join(sorted(unknown))} not found")
+            self._pipelines_ = [x for x in self._pipelines_ if x["name"] in pipelines]
+        self._index_ = DispatchIndex()
+        self._init_scan_ = []
+        for item in self._pipelines_:
+            item["debounce"] = 0.0
+            self._index_.add(item)
+            self._init_scan_.append(item["input"])
+        if not publish:
+            self.without("publish")
+        self._debounce_ = 0.0
+        self._dry_run_ = dry_run
+        self.collect()
+        cfg = dict(self._scheduler_cfg_)
+        if jobs:
+            cfg["concurrency"] = jobs
+        self._scheduler_ = Scheduler(self._loop_, self._async_handle, route=self._route, **cfg)
+        for item in self._pipelines_:
+            self._scheduler_.set_pipeline_limit(item["name"], item["concurrency"])
+
+        if report:
+            self._report_ = report
+        if dry_run:
+            # settled files are still skipped, but nothing is created or written
+            if self._state_ and not self._state_.open(readonly=True):
+                self._state_ = None
+            self._tracer_ = None
+        else:
+            if self._state_:
+                self._state_.open()
+            if self._tracer_:
+                self._tracer_.open()
+            self._open_engines()
+        asyncio.set_event_loop(self._loop_)
+        self._scheduler_.start()
+        try:
+            self._loop_.run_until_complete(self._async_sort())
+        finally:
+            self._summary_.finish()
+            self._shutdown()
+            if self._state_:
+                self._state_.close()
+            if self._tracer_:
+                self._tracer_.close()
+        return self._summary_
+
+    async def _async_sort(self):
+        await self._loop_.run_in_executor(None, self._initial_scan)
+        # the scanner has pushed everything, wait for the last of them
+        while self._current_tasks_:
+            await asyncio.sleep(0.05)
+
+    def _initial_scan(self):
+        logging.info("start initial scanning")
+        scanner = Scanner(self._push_scanned, self._prunable, self._accept if self._state_ else None,
+                          stopped=self._stopped_, **self._scanner_cfg_)
+        scanner.scan(self._init_scan_)
+        logging.info("initial scanning finished")
+
+    def _first(self, source: pathlib.Path) -> Optional[str]:
+        for pipeline, relative_path in self._index_.candidates(source):
+            if pipeline["matcher"].match(relative_path) and not pipeline["blacklist"].match(relative_path):
+                return pipeline["name"]
+        return None
+
+    def wanted(self, source: pathlib.Path) -> bool:
+        """whether any pipeline takes source, safe to call in any thread once the agent is configured"""
+        return self._first(source) is not None
+
+    def _route(self, context: Context) -> Optional[str]:
+        # the pipeline an event runs first, the scheduler parks it while that one is at its limit
+        return self._first(context["source"])
+
+    def watched(self, source: pathlib.Path) -> bool:
+        """whether source is under the input of any pipeline"""
+        return bool(self._index_.candidates(source))
+
+    def _prunable(self, path: str) -> bool:
+        # only directories blacklisted by every pipeline watching them can be skipped
+        candidates = self._index_.candidates(pathlib.Path(path))
+        return bool(candidates) and all(x["blacklist"].directory(y) for x, y in candidates)
+
+    def _accept(self, path: str, entry: os.DirEntry | None) -> bool:
+        try:
+            st = entry.stat() if entry else os.stat(path)
+        except OSError:
+            return True
+        return not self._state_.settled(st, path)
+
+    def _push_scanned(self, batch: list[tuple[str, bool, os.stat_result | None]]):
+        # the debouncer compares later stats of the file to this one, instead of stating it again
+        self.push_batch([{"source": pathlib.Path(x), "event": "initialize", "is_dir": y}
+                         for x, y, _ in batch], [(z.st_size, z.st_mtime_ns) if z else None for _, _, z in batch])
+
+    async def _async_close_publishers(self):
+        import dove
+        await dove.close_publishers()
 
     async def _async_quit(self):
         self._event_quit_.set()
@@ -130,96 +404,249 @@ class SortingAgent(threading.Thread):
     def require_quit(self):
         asyncio.run_coroutine_threadsafe(self._async_quit(), self._loop_)
 
-    def _blacklisted(self, path: pathlib.Path, blacklist):
-        for item in blacklist:
-            for part in path.parts:
-                if fnmatch(part, item):
-                    logging.debug(f"\'{path}\' is blacklisted by \'{item}\'")
-                    return True
-        return False
+    def _compile_steps(self, name: str, steps: list[dict], available: set[str]) -> list[dict]:
+        """check processes and compile templates, `available` collects the fields produced"""
+        ret = []
+        for i in steps:
+            if i["type"] not in ProcessMap.keys():
+                raise KeyError(f"invalid process '{i['type']}'")
+            step = dict(i)
+            step["seconds"] = _step_seconds_.labels(i["type"])
+            if i["type"] in TemplatedProcesses.keys() and "arg" in i.keys():
+                keys = TemplatedProcesses[i["type"]]
+                if keys and isinstance(i["arg"], dict):
+                    step["arg"] = {x: compile_templates(y) if x in keys else y for x, y in i["arg"].items()}
+                else:
+                    step["arg"] = compile_templates(i["arg"])
+                missing = fields_of(step["arg"]) - available
+                if missing:
+                    raise ValueError(f"{i['type']} of pipeline[{name}] uses {', '.join(sorted(missing))}, "
+                                     "which no earlier step produces")
+            if i["type"] in ProcessOutputs.keys():
+                try:
+                    available |= ProcessOutputs[i["type"]](i.get("arg", None))
+                except (TypeError, AttributeError) as e:
+                    raise ValueError(f"{i['type']} of pipeline[{name}] has an invalid arg "
+                                     f"{i.get('arg', None)!r}") from e
+            ret.append(step)
+        return freeze(ret)
+
+    def _compile_blacklist(self, patterns: list[str]) -> Blacklist:
+        # pipelines sharing the same blacklist share its matcher and verdict cache
+        key = tuple(patterns)
+        if key not in self._blacklists_.keys():
+            self._blacklists_[key] = Blacklist(patterns)
+        return self._blacklists_[key]
+
+    async def _async_process(self, cnt: int, t: Context, steps: list[dict], stop_on_failure: bool,
+                             trace: Trace | None = None) -> Context:
+        for h in steps:
+            f = ProcessMap[h["type"]]
+            arg = h.get("arg", None)
+            logging.debug(f"[{cnt}] enter {f.__name__}({arg})")
+            ts = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(f):
+                    t = await f(t, arg)
+                else:
+                    t = f(t, arg)
+                h["seconds"].observe(time.perf_counter() - ts)
+                if trace:
+                    trace.span(h["type"], ts, time.perf_counter(), args={"arg": arg, "ok": t["_ok"]})
+            except Exception as e:
+                if trace:
+                    trace.span(h["type"], ts, time.perf_counter(), args={"arg": arg, "error": repr(e)})
+                if not stop_on_failure:
+                    logging.critical(f"[{cnt}] handle {f.__name__} error, skipped")
+                    continue
+                logging.critical(f"[{cnt}] handle {f.__name__} error")
+                logging.critical(traceback.format_exc())
+                t["_ok"] = False
+            if stop_on_failure:
+                if not t["_ok"]:
+                    break
+                logging.debug(f'[{cnt}] {t}')
+        return t
 
-    async def _async_handle(self, context: dict):
+    async def _async_run_pipeline(self, cnt: int, pipeline: dict, t: Context, trace: Trace | None = None) -> Context:
+        context = t
+        try:
+            t = await self._async_process(cnt, t, pipeline["process"], True, trace)
+            if not t["_ok"]:
+                logging.warning(f"[{cnt}] failed, start failure cleanup")
+                t = await self._async_process(cnt, t, pipeline["failure"], False, trace)
+        finally:
+            # steps may return a new context, or be cancelled before returning one
+            locks = (t.get("locks", None) or set()) | (context.get("locks", None) or set())
+            if locks:
+                logging.debug(f"[{cnt}] release locks {locks} left by {pipeline['name']}")
+                lock_manager.release(locks)
+                t.pop("locks", None)
+                context.pop("locks", None)
+        return t
+
+    async def _async_plan(self, context: Context):
+        try:
+            if context["is_dir"]:
+                return None, OUTCOME_UNMATCHED
+            for pipeline, relative_path in self._index_.match(context["source"], 0):
+                if pipeline["blacklist"].match(relative_path):
+                    continue
+                t = context.derive(pipeline["context"], name=pipeline["name"], _ok=True, relative_path=relative_path)
+                self._report_(f"{context['source']} -> {pipeline['name']}: {'; '.join(plan(pipeline, t))}")
+                self._outcomes_[OUTCOME_PLANNED].inc()
+                return pipeline["name"], OUTCOME_PLANNED
+            self._outcomes_[OUTCOME_UNMATCHED].inc()
+            return None, OUTCOME_UNMATCHED
+        finally:
+            self._current_tasks_.pop(context["original"], None)
+
+    async def _async_handle(self, context: Context):
+        if self._summary_ is not None:
+            # sizes estimate the cost of a dry run
+            st = self._stat(context["source"])
+            if self._dry_run_:
+                matched, outcome = await self._async_plan(context)
+            else:
+                matched, outcome = await self._async_run(context)
+            size = st.st_size if st and not context["is_dir"] else 0
+            self._summary_.add(context["source"], matched, outcome, size, context["is_dir"])
+            return matched, outcome
+        return await self._async_run(context)
+
+    async def _async_run(self, context: Context):
+        matched, outcome = None, None
         try:
-            await asyncio.sleep(1)
             cnt = self._cnt_
             self._cnt_ += 1
             success = False
-            for pipeline in self._pipelines_:
-                t = deepcopy(context)
-                t["name"] = pipeline["name"]
-                t["_ok"] = True
-                if t["source"] == pipeline["input"]:
-                    continue
-                if not t["source"].is_relative_to(pipeline["input"]):
-                    continue
-                t["relative_path"] = t["source"].relative_to(pipeline["input"])
-                if "re" in pipeline.keys():
-                    if not re.match(pipeline["re"], str(t["relative_path"])):
-                        logging.debug(f"[{cnt}] \"{t['relative_path']}\" unmatched to REGEX\"{pipeline['re']}\"")
-                        continue
-                elif "glob" in pipeline.keys():
-                    if not t["relative_path"].match(pipeline["glob"]):
-                        logging.debug(f"[{cnt}] \"{t['relative_path']}\" unmatched to GLOB\"{pipeline['glob']}\"")
-                        continue
-                else:
-                    continue
-                if self._blacklisted(t["relative_path"], pipeline["blacklist"]):
+            matched = None
+            trace = self._tracer_.begin(cnt) if self._tracer_ else None
+            if trace:
+                # debounce and the queue of the scheduler
+                trace.since("queued", context["timestamp"])
+            st = self._stat(context["source"]) if self._state_ else None
+            for pipeline, relative_path in self._index_.match(context["source"], cnt):
+                if pipeline["blacklist"].match(relative_path):
                     continue
+                t = context.derive(pipeline["context"], name=pipeline["name"], _ok=True, relative_path=relative_path)
                 logging.info(f"[{cnt}] matched {pipeline['name']} for {t['source']}")
-                t.update(pipeline["context"])
-                for h in pipeline["process"]:
-                    f = ProcessMap[h["type"]]
-                    arg = deepcopy(h.get("arg", None))
-                    logging.debug(f"[{cnt}] enter {f.__name__}({arg})")
-                    try:
-                        if asyncio.iscoroutinefunction(f):
-                            t = await f(t, arg)
-                        else:
-                            t = f(t, arg)
-                    except Exception as e:
-                        logging.critical(f"[{cnt}] handle {f.__name__} error")
-                        logging.critical(traceback.format_exc())
-                        t["_ok"] = False
-                    if not t["_ok"]:
-                        break
-                    logging.debug(f'[{cnt}] {t}')
-
+                matched = pipeline["name"]
+                async with self._scheduler_.pipeline(pipeline["name"]):
+                    ts = time.perf_counter()
+                    t = await self._async_run_pipeline(cnt, pipeline, t, trace)
+                    ok = "true" if t["_ok"] else "false"
+                    pipeline["seconds"][ok].observe(time.perf_counter() - ts)
+                if trace:
+                    trace.span(pipeline["name"], ts, time.perf_counter(), "pipeline", {"ok": t["_ok"]})
                 if t["_ok"]:
                     success = True
                     break
-                else:
-                    logging.warning(f"[{cnt}] failed, start failure cleanup")
-                    for h in pipeline["failure"]:
-                        f = ProcessMap[h["type"]]
-                        arg = deepcopy(h.get("arg", None))
-                        logging.debug(f"[{cnt}] enter {f.__name__}({arg})")
-                        try:
-                            if asyncio.iscoroutinefunction(f):
-                                t = await f(t, arg)
-                            else:
-                                t = f(t, arg)
-                        except Exception as e:
-                            logging.critical(f"[{cnt}] handle {f.__name__} error, skipped")
 
             if success:
                 logging.info(f"[{cnt}] success to process {context['source']}")
+                self._outcomes_["success"].inc()
             else:
                 logging.warning(f"[{cnt}] unmatched any patterns for {context['source']}")
+                self._outcomes_["failure" if matched else "unmatched"].inc()
+            if success:
+                outcome = OUTCOME_SUCCESS
+            elif matched:
+                outcome = OUTCOME_FAILURE
+            else:
+                outcome = OUTCOME_UNMATCHED
+            if st:
+                self._state_.record(st, context["source"], matched, outcome)
+            if trace:
+                trace.finish(str(context["source"]), {"event": context["event"], "pipeline": matched,
+                                                      "outcome": outcome})
         except Exception as e:
             logging.critical(traceback.format_exc())
+            outcome = OUTCOME_FAILURE
+        finally:
+            self._current_tasks_.pop(context["original"], None)
+        return matched, outcome
+
+    def _stat(self, path: pathlib.Path) -> os.stat_result | None:
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
+
+    def _window(self, source: pathlib.Path) -> float:
+        windows = [x["debounce"] for x, _ in self._index_.candidates(source)]
+        return max(windows, default=self._debounce_)
+
+    def _arm(self, batch: list[tuple[dict, int, tuple[int, int] | None]]):
+        for context, priority, snapshot in batch:
+            source = context["source"]
+            if context["event"] == "deleted":
+                self._forget(source, context["is_dir"])
+                continue
+            if source in self._current_tasks_.keys():
+                if source in self._debouncer_:
+                    self._debouncer_.arm(source, source, None, self._window(source))
+                    self._dropped_["pending"].inc()
+                else:
+                    logging.debug(f"debounce {source}")
+                    self._dropped_["running"].inc()
+                self._scheduler_.release(priority)
+                continue
+            self._current_tasks_[source] = context
+            window = self._window(source)
+            if window > 0:
+                self._debouncer_.arm(source, source, (context, priority), window, snapshot)
+            else:
+                self._dispatch((context, priority))
+
+    def _forget(self, source: pathlib.Path, is_dir: bool):
+        # a running event is left alone, its steps find the file gone
+        keys = [x for x in self._current_tasks_.keys() if x.is_relative_to(source)] if is_dir else [source]
+        for key in keys:
+            payload = self._debouncer_.discard(key)
+            if payload is not None:
+                logging.debug(f"{key} deleted before settling, dropped")
+                self._drop(payload)
+
+    def _dispatch(self, payload: tuple[dict, int]):
+        context, priority = payload
+        self._scheduler_.put(context, priority)
+
+    def _drop(self, payload: tuple[dict, int]):
+        context, priority = payload
+        self._dropped_["vanished"].inc()
+        self._current_tasks_.pop(context["original"], None)
+        self._scheduler_.release(priority)
 
     def push(self, context):
-        self._mutex_.acquire()
-        if context["source"] in self._current_tasks_.keys():
-            logging.debug(f"debounce {context['source']}")
-        else:
+        self.push_batch([context])
+
+    def push_batch(self, contexts: list[dict], snapshots: Optional[list[tuple[int, int] | None]] = None):
+        """hand contexts to the loop with a single wakeup, must not be called in the loop thread
+
+        snapshots --- (size, mtime_ns) of every source if already known, the debouncer stats them otherwise
+        """
+        batch = []
+        timestamp = int(datetime.now().timestamp() * 1e9)
+        for context, snapshot in zip(contexts, snapshots or itertools.repeat(None)):
+            if context["event"] == "deleted":
+                # only drops pending events, so it takes no slot
+                batch.append((Context(**context), None, None))
+                continue
+            priority = PRIORITY_INITIALIZE if context["event"] == "initialize" else PRIORITY_EVENT
+            # blocks the observer or the scanner while the queue is full
+            while not self._scheduler_.acquire(priority, timeout=1.0):
+                if self._stopped_.is_set():
+                    for _, item, _ in batch:
+                        if item is not None:
+                            self._scheduler_.release(item)
+                    return
             logging.debug(f"push {context}")
-            context["timestamp"] = int(datetime.now().timestamp() * 1e9)
+            context = Context(**context)
+            context["timestamp"] = timestamp
             context["original"] = context["source"]
-            task = asyncio.run_coroutine_threadsafe(self._async_handle(context), self._loop_)
-            self._current_tasks_[context["source"]] = task
-            task.add_done_callback(lambda task: self._current_tasks_.pop(context["source"]))
-        self._mutex_.release()
+            batch.append((context, priority, snapshot))
+        self._loop_.call_soon_threadsafe(self._arm, batch)
 
 
 if __name__ == "__main__":
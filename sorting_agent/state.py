@@ -0,0 +1,131 @@
+import logging
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+__all__ = ["StateIndex", "OUTCOME_SUCCESS", "OUTCOME_FAILURE", "OUTCOME_UNMATCHED"]
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_FAILURE = "failure"
+OUTCOME_UNMATCHED = "unmatched"
+
+# outcomes that need no more work as long as neither file nor pipelines change
+_SETTLED_ = (OUTCOME_SUCCESS, OUTCOME_UNMATCHED)
+
+_SCHEMA_ = """
+CREATE TABLE IF NOT EXISTS state (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    pipeline TEXT,
+    outcome TEXT NOT NULL,
+    generation TEXT NOT NULL,
+    updated INTEGER NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns)
+) WITHOUT ROWID
+"""
+
+
+def state_key(st: os.stat_result) -> tuple[int, int, int, int]:
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class StateIndex():
+    """on-disk index of handled files, keyed by (dev, ino, size, mtime_ns)
+
+    `generation` fingerprints the pipelines, entries of other generations are ignored.
+    writes are queued and committed in batches by a background thread
+    """
+
+    def __init__(self, path: str | pathlib.Path, generation: str,
+                 batch_size: int = 1024, interval: float = 1.0) -> None:
+        self._path_ = pathlib.Path(path)
+        self._generation_ = generation
+        self._batch_size_ = batch_size
+        self._interval_ = interval
+        self._queue_: queue.Queue = queue.Queue()
+        self._local_ = threading.local()
+        self._writer_: Optional[threading.Thread] = None
+        self._readonly_ = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._readonly_:
+            return sqlite3.connect(f"{self._path_.absolute().as_uri()}?mode=ro", uri=True, timeout=30)
+        conn = sqlite3.connect(self._path_, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local_, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local_.conn = conn
+        return conn
+
+    def open(self, readonly: bool = False) -> bool:
+        """open the index, with `readonly` only for lookups, return False if there is none to read"""
+        if readonly:
+            self._readonly_ = True
+            if not self._path_.exists():
+                return False
+            logging.info(f"state index {self._path_} opened read only")
+            return True
+        self._path_.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA_)
+        self._writer_ = threading.Thread(target=self._write_loop, name="state-index", daemon=True)
+        self._writer_.start()
+        logging.info(f"state index {self._path_} opened")
+        return True
+
+    def close(self) -> None:
+        if self._writer_ is None:
+            return
+        self._queue_.put(None)
+        self._writer_.join()
+        self._writer_ = None
+        logging.info(f"state index {self._path_} closed")
+
+    def settled(self, st: os.stat_result, path: str | pathlib.Path) -> bool:
+        """whether the file was handled at path by the current pipelines and has not changed since"""
+        row = self._reader().execute(
+            "SELECT outcome, generation, path FROM state WHERE dev=? AND ino=? AND size=? AND mtime_ns=?",
+            state_key(st)).fetchone()
+        # a file moved while the agent was down keeps its key, but may match other pipelines now
+        return (row is not None and row[1] == self._generation_ and row[0] in _SETTLED_
+                and row[2] == str(pathlib.Path(path)))
+
+    def record(self, st: os.stat_result, path: pathlib.Path, pipeline: Optional[str], outcome: str) -> None:
+        self._queue_.put((*state_key(st), str(path), pipeline, outcome, self._generation_, time.time_ns()))
+
+    def _write_loop(self):
+        conn = self._connect()
+        quit = False
+        while not quit:
+            batch = []
+            deadline = time.monotonic() + self._interval_
+            while len(batch) < self._batch_size_:
+                try:
+                    item = self._queue_.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    quit = True
+                    break
+                batch.append(item)
+            if not batch:
+                continue
+            try:
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                logging.debug(f"state index committed {len(batch)} entries")
+            except sqlite3.Error as e:
+                logging.error(f"state index failed to commit {len(batch)} entries: {e}")
+        conn.close()
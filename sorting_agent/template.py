@@ -0,0 +1,77 @@
+from string import Formatter
+from typing import Any, Mapping
+
+__all__ = ["Template", "compile_templates", "fields_of", "render"]
+
+_formatter_ = Formatter()
+
+
+def _fields(source: str) -> set[str]:
+    ret = set()
+    for _, field, spec, _ in _formatter_.parse(source):
+        if field is None:
+            continue
+        if field == "" or field.isdigit():
+            raise ValueError(f"positional field is not allowed in \"{source}\"")
+        # "{a.b[0]}" needs a only
+        ret.add(field.split(".", 1)[0].split("[", 1)[0])
+        if spec:
+            ret |= _fields(spec)
+    return ret
+
+
+class Template():
+    """str.format template compiled once, knowing the context fields it needs"""
+
+    __slots__ = ("source", "fields", "_static_")
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.fields = frozenset(_fields(source))
+        self._static_ = None if self.fields else source.format()
+
+    def render(self, context: Mapping[str, Any]) -> str:
+        if self._static_ is not None:
+            return self._static_
+        return self.source.format_map({x: context[x] for x in self.fields})
+
+    def __repr__(self) -> str:
+        return repr(self.source)
+
+    def __str__(self) -> str:
+        return self.source
+
+
+def compile_templates(arg: Any) -> Any:
+    """replace every string in a step argument with a Template"""
+    if isinstance(arg, str):
+        return Template(arg)
+    if isinstance(arg, dict):
+        return {x: compile_templates(y) for x, y in arg.items()}
+    if isinstance(arg, (list, tuple)):
+        return [compile_templates(x) for x in arg]
+    return arg
+
+
+def fields_of(arg: Any) -> set[str]:
+    """all context fields needed by the templates of a compiled argument"""
+    if isinstance(arg, Template):
+        return set(arg.fields)
+    if isinstance(arg, dict):
+        return set().union(*[fields_of(x) for x in arg.values()])
+    if isinstance(arg, (list, tuple)):
+        return set().union(*[fields_of(x) for x in arg])
+    return set()
+
+
+def render(value: Any, context: Mapping[str, Any]) -> Any:
+    """render Templates, or format raw strings, also inside lists and dicts"""
+    if isinstance(value, Template):
+        return value.render(context)
+    if isinstance(value, str):
+        return value.format(**context)
+    if isinstance(value, dict):
+        return {x: render(y, context) for x, y in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [render(x, context) for x in value]
+    return value
@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import pathlib
+import queue
+import random
+import threading
+import time
+from typing import Any, Optional
+
+__all__ = ["Tracer", "Trace"]
+
+
+class Trace():
+    """spans of one event, timed by time.perf_counter"""
+
+    __slots__ = ("_tracer_", "_tid_", "_events_", "_sampled_", "_start_")
+
+    def __init__(self, tracer: "Tracer", tid: int, sampled: bool) -> None:
+        self._tracer_ = tracer
+        self._tid_ = tid
+        self._events_: list[dict] = []
+        self._sampled_ = sampled
+        self._start_ = time.perf_counter()
+
+    def _add(self, name: str, category: str, ts: float, dur: float, args: Optional[dict[str, Any]]):
+        event = {"name": name, "cat": category, "ph": "X", "ts": ts, "dur": dur,
+                 "pid": self._tracer_.pid, "tid": self._tid_}
+        if args:
+            event["args"] = args
+        self._events_.append(event)
+
+    def span(self, name: str, start: float, end: float, category: str = "step",
+             args: Optional[dict[str, Any]] = None) -> None:
+        """add a span between two readings of time.perf_counter"""
+        self._add(name, category, self._tracer_.epoch(start), (end - start) * 1e6, args)
+
+    def since(self, name: str, timestamp: int, category: str = "queue") -> None:
+        """add a span from an epoch timestamp in ns to the start of the event"""
+        ts = timestamp / 1e3
+        self._add(name, category, ts, max(0.0, self._tracer_.epoch(self._start_) - ts), None)
+
+    def finish(self, name: str, args: Optional[dict[str, Any]] = None) -> None:
+        """close the span of the event, and hand every span to the writer if kept"""
+        end = time.perf_counter()
+        if not self._sampled_ and end - self._start_ < self._tracer_.slow:
+            return
+        self.span(name, self._start_, end, "event", args)
+        # names the row of this event in the viewer
+        self._events_.append({"name": "thread_name", "ph": "M", "pid": self._tracer_.pid, "tid": self._tid_,
+                              "args": {"name": f"[{self._tid_}] {name}"}})
+        self._tracer_.emit(self._events_)
+
+
+class Tracer():
+    """per-event spans written as chrome trace-event json, open it in perfetto or chrome://tracing
+
+    `sample` of the events are traced, plus every event slower than `slow` seconds,
+    whose spans are kept in memory until it finishes. spans are written by a background
+    thread in batches, and dropped when more than `buffer` of them wait
+    """
+
+    def __init__(self, path: str | pathlib.Path, sample: float = 1.0, slow: Optional[float] = None,
+                 buffer: int = 65536, interval: float = 1.0) -> None:
+        self._path_ = pathlib.Path(path)
+        self._sample_ = sample
+        self.slow = slow if slow is not None else float("inf")
+        self._interval_ = interval
+        self._queue_: queue.Queue = queue.Queue(buffer)
+        self._writer_: Optional[threading.Thread] = None
+        self._dropped_ = 0
+        self.pid = os.getpid()
+        # perf_counter is precise, time_ns gives the epoch
+        self._offset_ = time.time_ns() / 1e3 - time.perf_counter() * 1e6
+
+    def epoch(self, counter: float) -> float:
+        """microseconds since the epoch of a time.perf_counter reading"""
+        return counter * 1e6 + self._offset_
+
+    def begin(self, tid: int) -> Optional[Trace]:
+        """a trace for an event, None if it is not sampled and cannot turn out slow"""
+        if self._writer_ is None:
+            return None
+        sampled = self._sample_ >= 1.0 or random.random() < self._sample_
+        if not sampled and self.slow == float("inf"):
+            return None
+        return Trace(self, tid, sampled)
+
+    def emit(self, events: list[dict]) -> None:
+        for item in events:
+            try:
+                self._queue_.put_nowait(item)
+            except queue.Full:
+                if self._dropped_ % 1000 == 0:
+                    logging.warning(f"trace buffer of {self._path_} is full, spans dropped")
+                self._dropped_ += 1
+
+    def open(self) -> None:
+        self._path_.parent.mkdir(parents=True, exist_ok=True)
+        self._writer_ = threading.Thread(target=self._write_loop, name="tracer", daemon=True)
+        self._writer_.start()
+        logging.info(f"trace to {self._path_}")
+
+    def close(self) -> None:
+        if self._writer_ is None:
+            return
+        self._queue_.put(None)
+        self._writer_.join()
+        self._writer_ = None
+
+    def _write_loop(self):
+        with open(self._path_, "w") as f:
+            # the json array format, its closing bracket is optional for viewers
+            f.write("[\n")
+            first = True
+            stop = False
+            while not stop:
+                batch = []
+                try:
+                    item = self._queue_.get(timeout=self._interval_)
+                    while True:
+                        if item is None:
+                            stop = True
+                            break
+                        batch.append(item)
+                        item = self._queue_.get_nowait()
+                except queue.Empty:
+                    pass
+                if batch:
+                    text = ",\n".join(json.dumps(x, default=str) for x in batch)
+                    f.write(text if first else ",\n" + text)
+                    first = False
+                    f.flush()
+            f.write("\n]\n")
+        if self._dropped_:
+            logging.warning(f"{self._dropped_} spans of {self._path_} dropped")
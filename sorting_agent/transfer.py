@@ -0,0 +1,156 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import logging
+import os
+import pathlib
+import shutil
+from typing import Optional
+import shortuuid
+from metrics import registry
+from .locks import LockManager
+from .shared import SharedEngine
+
+__all__ = ["TransferEngine", "engine"]
+
+_moved_ = registry.counter("sorting_moved_bytes_total", "bytes of moved files, by method", ["method"])
+_files_ = registry.counter("sorting_moved_files_total", "moved files and directories, by method", ["method"])
+
+
+def _fsync_dir(path: pathlib.Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TransferEngine(SharedEngine):
+    """move files without blocking the event loop
+
+    a move on the same filesystem is a single os.rename. across devices the file is
+    copied in a thread pool with copy_file_range or sendfile into a temporary file
+    next to the destination, fsynced, renamed into place, and only then is the source
+    removed. at most `per_device` transfers write to one destination device at once
+    """
+
+    def __init__(self, workers: int = 4, per_device: int = 1, chunk_size: int = 64 * 1024 * 1024) -> None:
+        super().__init__()
+        self._workers_ = workers
+        self._chunk_size_ = chunk_size
+        self._pool_: Optional[ThreadPoolExecutor] = None
+        # shared by the loops of every agent
+        self._devices_ = LockManager(default=per_device)
+
+    def configure(self, workers: Optional[int] = None, per_device: Optional[int] = None,
+                  chunk_size: Optional[int] = None) -> None:
+        super().configure(workers=workers, per_device=per_device, chunk_size=chunk_size)
+
+    def _configure(self, workers=None, per_device=None, chunk_size=None):
+        if workers:
+            self._workers_ = workers
+        if per_device:
+            self._devices_.configure(default=per_device)
+        if chunk_size:
+            self._chunk_size_ = chunk_size
+
+    def _copy_range(self, fsrc, fdst, size: int, progress: dict) -> int:
+        done = 0
+        method = "copy_file_range" if hasattr(os, "copy_file_range") else "sendfile"
+        while done < size:
+            count = min(self._chunk_size_, size - done)
+            try:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), count)
+                elif method == "sendfile":
+                    n = os.sendfile(fdst.fileno(), fsrc.fileno(), done, count)
+                else:
+                    n = fdst.write(fsrc.read(count))
+            except OSError as e:
+                if method == "copy":
+                    raise
+                # not supported between these filesystems, degrade to the next method
+                logging.debug(f"{method} failed with {e}, fall back")
+                method = "sendfile" if method == "copy_file_range" else "copy"
+                fsrc.seek(done)
+                fdst.seek(done)
+                continue
+            if n == 0:
+                if method == "copy":
+                    break
+                # some filesystems report 0 rather than an error, only read() tells the true end
+                logging.debug(f"{method} copied nothing at {done}/{size}, fall back")
+                method = "copy"
+                fsrc.seek(done)
+                fdst.seek(done)
+                continue
+            done += n
+            progress["transferred"] = done
+        progress["transfer_method"] = method
+        return done
+
+    def _copy(self, source: pathlib.Path, destination: pathlib.Path, progress: dict):
+        temp = destination.with_name(f".{destination.name}.{shortuuid.random(8)}.part")
+        try:
+            with open(source, "rb") as fsrc, open(temp, "wb") as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                done = self._copy_range(fsrc, fdst, size, progress)
+                if done != size:
+                    raise OSError(errno.EIO, f"short copy, {done} of {size} bytes", str(source))
+                fdst.flush()
+                os.fsync(fdst.fileno())
+            shutil.copystat(source, temp)
+            os.rename(temp, destination)
+            _fsync_dir(destination.parent)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+        os.unlink(source)
+
+    async def move(self, source: pathlib.Path, destination: pathlib.Path, progress: dict) -> pathlib.Path:
+        """move source to destination, whose parent must exist, return where it ends up
+
+        like shutil.move, source goes into destination if that is an existing directory.
+        progress["transferred"] follows the bytes written, progress["transfer_size"] is the total
+        """
+        if destination.is_dir():
+            destination = destination / source.name
+        st = os.stat(source)
+        dev = os.stat(destination.parent).st_dev
+        progress["transfer_size"] = st.st_size
+        progress["transferred"] = 0
+        if st.st_dev == dev:
+            try:
+                os.rename(source, destination)
+            except OSError as e:
+                # bind mounts of one filesystem share st_dev, yet rename refuses to cross them
+                if e.errno != errno.EXDEV:
+                    raise
+                logging.debug(f"rename {source} to {destination} crosses mount points, copy instead")
+            else:
+                progress["transferred"] = st.st_size
+                progress["transfer_method"] = "rename"
+                _moved_.labels("rename").inc(st.st_size)
+                _files_.labels("rename").inc()
+                return destination
+        if self._pool_ is None:
+            self._pool_ = ThreadPoolExecutor(self._workers_, thread_name_prefix="transfer")
+        loop = asyncio.get_running_loop()
+        async with self._devices_.locked(str(dev)):
+            logging.debug(f"transfer {source} to {destination} across devices")
+            if source.is_dir():
+                progress["transfer_method"] = "copytree"
+                await loop.run_in_executor(self._pool_, shutil.move, source, destination)
+            else:
+                await loop.run_in_executor(self._pool_, self._copy, source, destination, progress)
+        _moved_.labels(progress["transfer_method"]).inc(progress["transferred"])
+        _files_.labels(progress["transfer_method"]).inc()
+        return destination
+
+    def _shutdown(self):
+        if self._pool_:
+            self._pool_.shutdown(wait=True)
+            self._pool_ = None
+
+
+engine = TransferEngine()